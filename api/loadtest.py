@@ -0,0 +1,354 @@
+"""
+Load-test and soak harness for the HTTP service.
+
+Drives the composite and individual endpoints with a fixed number of
+concurrent clients for a set duration, then reports throughput, latency
+percentiles and error rates per endpoint. While the load runs, the server is
+sampled on an interval: RSS, open FDs and child processes from /proc (Linux,
+needs the server PID) plus the tracemalloc and engine-call counters from
+/performance-report. Child processes still alive after the settle period
+are reported as leaked engine processes.
+
+Against a running server (PID lets the harness read /proc):
+    python -m api.loadtest --url http://127.0.0.1:5477 --server-pid 1234 --duration 300
+
+Start a local server and soak it:
+    python -m api.loadtest --spawn --duration 600 --concurrency 32 \\
+        --mix nps=4,index=4,filter=1,validator=1,parse=1 --sizes 10=6,1000=3,20000=1
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+API_PREFIX = "/blackrock/challenge/v1"
+ENDPOINTS = {
+    "nps": "/returns:nps",
+    "index": "/returns:index",
+    "parse": "/transactions:parse",
+    "validator": "/transactions:validator",
+    "filter": "/transactions:filter",
+}
+PAYLOAD_VARIANTS = 4
+YEAR_START = datetime(2023, 1, 1)
+YEAR_SECONDS = 365 * 24 * 3600
+
+
+def parse_weights(spec: str, cast=str) -> List[Tuple[Any, float]]:
+    """Parses "a=3,b=1" into [(a, 3.0), (b, 1.0)]; a bare name weighs 1."""
+    weights = []
+    for item in spec.split(","):
+        name, _, weight = item.strip().partition("=")
+        weights.append((cast(name), float(weight or 1)))
+    return weights
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    # pct * n first: 0.9 * 100 is 90.00000000000001, which would round up a rank.
+    rank = max(1, min(len(sorted_values), math.ceil(pct * len(sorted_values) / 100)))
+    return sorted_values[rank - 1]
+
+
+# ---------------------------------------------------------
+# Payloads
+# ---------------------------------------------------------
+
+def random_dates(rng: random.Random, n: int) -> List[str]:
+    """n distinct timestamps in 2023, in time order."""
+    offsets = sorted(rng.sample(range(YEAR_SECONDS), n))
+    return [(YEAR_START + timedelta(seconds=s)).strftime("%Y-%m-%d %H:%M:%S") for s in offsets]
+
+
+def random_periods(rng: random.Random, n: int, field: Optional[str] = None) -> List[Dict[str, Any]]:
+    periods = []
+    for _ in range(n):
+        start, end = random_dates(rng, 2)
+        period = {"start": start, "end": end}
+        if field:
+            period[field] = rng.randint(0, 200)
+        periods.append(period)
+    return periods
+
+
+def build_payload(endpoint: str, size: int, rng: random.Random) -> Any:
+    """Request body for one endpoint with `size` transactions."""
+    dates = random_dates(rng, size)
+    amounts = [round(rng.uniform(1, 5000), 2) for _ in range(size)]
+    expenses = [{"date": d, "amount": a} for d, a in zip(dates, amounts)]
+
+    if endpoint == "parse":
+        return expenses
+
+    transactions = []
+    for idx, (d, a) in enumerate(zip(dates, amounts)):
+        ceiling = math.ceil(a / 100.0) * 100
+        transactions.append({"id": f"txn_{idx}", "date": d, "amount": a, "ceiling": ceiling, "remanent": round(ceiling - a, 2)})
+
+    wage = rng.choice([25000, 50000, 150000, 400000])
+    if endpoint == "validator":
+        return {"wage": wage, "transactions": transactions}
+
+    q, p, k = random_periods(rng, 3, "fixed"), random_periods(rng, 3, "extra"), random_periods(rng, 5)
+    if endpoint == "filter":
+        return {"wage": wage, "q_periods": q, "p_periods": p, "k_periods": k, "transactions": transactions}
+
+    return {"age": rng.randint(20, 65), "wage": wage, "inflation": 5.5, "q": q, "p": p, "k": k, "transactions": expenses}
+
+
+def build_payloads(mix: List[Tuple[str, float]], sizes: List[Tuple[int, float]],
+                   rng: random.Random) -> Dict[Tuple[str, int], List[bytes]]:
+    """Pre-serializes a few bodies per (endpoint, size) so the clients only send."""
+    return {
+        (endpoint, size): [json.dumps(build_payload(endpoint, size, rng)).encode() for _ in range(PAYLOAD_VARIANTS)]
+        for endpoint, _ in mix for size, _ in sizes
+    }
+
+
+# ---------------------------------------------------------
+# Server sampling
+# ---------------------------------------------------------
+
+def proc_stats(pid: int) -> Dict[str, Any]:
+    """RSS, open FDs and live child processes of `pid`, read from /proc."""
+    stats: Dict[str, Any] = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    stats["rssKb"] = int(line.split()[1])
+        stats["fds"] = len(os.listdir(f"/proc/{pid}/fd"))
+    except OSError:
+        return stats
+
+    children = 0
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # comm may contain spaces; the fields after its closing paren are fixed.
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            children += 1
+    stats["children"] = children
+    return stats
+
+
+async def take_sample(client: httpx.AsyncClient, server_pid: Optional[int], started: float) -> Dict[str, Any]:
+    sample: Dict[str, Any] = {"t": round(time.perf_counter() - started, 2)}
+    if server_pid:
+        sample.update(proc_stats(server_pid))
+    try:
+        metrics = (await client.get(f"{API_PREFIX}/performance-report")).json()["metrics"]
+        sample["tracemallocMB"] = metrics["memoryUsage"]["currentMB"]
+        sample["engineCalls"] = metrics["totalEngineCalls"]
+        sample["threads"] = metrics["concurrency"]["activeThreads"]
+    except (httpx.HTTPError, ValueError, KeyError):
+        pass
+    return sample
+
+
+async def sample_server(client: httpx.AsyncClient, server_pid: Optional[int], interval: float,
+                        started: float, samples: List[Dict[str, Any]], stop: asyncio.Event):
+    while not stop.is_set():
+        samples.append(await take_sample(client, server_pid, started))
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+# ---------------------------------------------------------
+# Load generation
+# ---------------------------------------------------------
+
+async def run_client(client: httpx.AsyncClient, payloads: Dict[Tuple[str, int], List[bytes]],
+                     mix: List[Tuple[str, float]], sizes: List[Tuple[int, float]], deadline: float,
+                     rng: random.Random, results: Dict[str, Dict[str, Any]]):
+    endpoints, endpoint_weights = zip(*mix)
+    size_values, size_weights = zip(*sizes)
+    headers = {"Content-Type": "application/json"}
+
+    while time.perf_counter() < deadline:
+        endpoint = rng.choices(endpoints, endpoint_weights)[0]
+        size = rng.choices(size_values, size_weights)[0]
+        body = rng.choice(payloads[(endpoint, size)])
+        stats = results[endpoint]
+
+        start = time.perf_counter()
+        try:
+            response = await client.post(API_PREFIX + ENDPOINTS[endpoint], content=body, headers=headers)
+            status = response.status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        stats["latencies"].append(time.perf_counter() - start)
+        if status != 200:
+            stats["errors"][str(status)] = stats["errors"].get(str(status), 0) + 1
+
+
+def summarize(results: Dict[str, Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    def block(latencies: List[float], errors: int) -> Dict[str, Any]:
+        ordered = sorted(latencies)
+        count = len(ordered)
+        return {
+            "requests": count,
+            "throughputRps": round(count / elapsed, 2) if elapsed else 0.0,
+            "errorRate": round(errors / count, 4) if count else 0.0,
+            **{f"p{p}Ms": round(percentile(ordered, p) * 1000, 2) for p in (50, 90, 99)},
+            "maxMs": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+        }
+
+    endpoints = {}
+    all_latencies, all_errors = [], 0
+    for name, stats in results.items():
+        errors = sum(stats["errors"].values())
+        endpoints[name] = {**block(stats["latencies"], errors), "errors": stats["errors"]}
+        all_latencies.extend(stats["latencies"])
+        all_errors += errors
+    return {"overall": block(all_latencies, all_errors), "endpoints": endpoints}
+
+
+def growth(samples: List[Dict[str, Any]], settled: Dict[str, Any]) -> Dict[str, Any]:
+    """Change in each server metric from the first sample to the settled one."""
+    if not samples:
+        return {}
+    first = samples[0]
+    return {
+        key: {"start": first[key], "end": settled[key], "delta": round(settled[key] - first[key], 4)}
+        for key in ("rssKb", "fds", "children", "tracemallocMB", "engineCalls", "threads")
+        if key in first and key in settled
+    }
+
+
+async def run_load(args, server_pid: Optional[int]) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    mix = parse_weights(args.mix)
+    sizes = parse_weights(args.sizes, int)
+    unknown = [name for name, _ in mix if name not in ENDPOINTS]
+    if unknown:
+        raise SystemExit(f"Unknown endpoints in --mix: {', '.join(unknown)}")
+
+    payloads = build_payloads(mix, sizes, rng)
+    results = {name: {"latencies": [], "errors": {}} for name, _ in mix}
+    samples: List[Dict[str, Any]] = []
+
+    limits = httpx.Limits(max_connections=args.concurrency + 1, max_keepalive_connections=args.concurrency + 1)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        started = time.perf_counter()
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_server(client, server_pid, args.sample_interval, started, samples, stop))
+
+        deadline = started + args.duration
+        await asyncio.gather(*(
+            run_client(client, payloads, mix, sizes, deadline, random.Random(rng.random()), results)
+            for _ in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await sampler
+
+        # Let in-flight engine processes exit before judging leaks.
+        await asyncio.sleep(args.settle)
+        settled = await take_sample(client, server_pid, started)
+
+    report = summarize(results, elapsed)
+    report.update({
+        "config": {"url": args.url, "concurrency": args.concurrency, "durationS": args.duration,
+                   "mix": args.mix, "sizes": args.sizes, "seed": args.seed},
+        "elapsedS": round(elapsed, 2),
+        "server": {"samples": samples, "settled": settled, "growth": growth(samples, settled)},
+    })
+    if settled.get("children"):
+        report["server"]["leakedChildren"] = settled["children"]
+    return report
+
+
+def print_report(report: Dict[str, Any]):
+    rows = [("overall", report["overall"])] + list(report["endpoints"].items())
+    print(f"{'endpoint':<10} {'reqs':>8} {'rps':>9} {'err%':>7} {'p50ms':>9} {'p90ms':>9} {'p99ms':>9} {'maxms':>9}")
+    for name, r in rows:
+        print(f"{name:<10} {r['requests']:>8} {r['throughputRps']:>9} {r['errorRate'] * 100:>7.2f} "
+              f"{r['p50Ms']:>9} {r['p90Ms']:>9} {r['p99Ms']:>9} {r['maxMs']:>9}")
+
+    for name, r in report["endpoints"].items():
+        if r["errors"]:
+            print(f"errors[{name}]: {r['errors']}")
+
+    print("\nserver over time:")
+    for sample in report["server"]["samples"] + [report["server"]["settled"]]:
+        print("  " + "  ".join(f"{k}={v}" for k, v in sample.items()))
+
+    for key, g in report["server"]["growth"].items():
+        print(f"growth {key}: {g['start']} -> {g['end']} ({g['delta']:+})")
+    if report["server"].get("leakedChildren"):
+        print(f"WARNING: {report['server']['leakedChildren']} child process(es) still alive after settling")
+
+
+def spawn_server(port: int) -> subprocess.Popen:
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "api.main:app", "--host", "127.0.0.1", "--port", str(port)])
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}{API_PREFIX}/performance-report", timeout=1)
+            return server
+        except httpx.HTTPError:
+            if server.poll() is not None:
+                raise SystemExit("uvicorn exited before accepting connections")
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("uvicorn did not start within 30s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test and soak harness for the HTTP service")
+    parser.add_argument("--url", default="http://127.0.0.1:5477")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds of load")
+    parser.add_argument("--mix", default="nps=4,index=4,filter=1,validator=1,parse=1",
+                        help="Endpoint weights, from: " + ", ".join(ENDPOINTS))
+    parser.add_argument("--sizes", default="10=6,1000=3,10000=1",
+                        help="Transactions-per-request weights")
+    parser.add_argument("--timeout", type=float, default=60, help="Per-request timeout in seconds")
+    parser.add_argument("--sample-interval", type=float, default=5, help="Seconds between server samples")
+    parser.add_argument("--settle", type=float, default=2, help="Seconds to wait after load before the final sample")
+    parser.add_argument("--server-pid", type=int, help="Server PID for /proc RSS/FD/child sampling")
+    parser.add_argument("--spawn", action="store_true", help="Start uvicorn api.main:app on the --url port and sample it")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json-out", help="Also write the full report as JSON")
+    args = parser.parse_args()
+
+    server = None
+    server_pid = args.server_pid
+    if args.spawn:
+        server = spawn_server(httpx.URL(args.url).port or 5477)
+        server_pid = server.pid
+
+    try:
+        report = asyncio.run(run_load(args, server_pid))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print_report(report)
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
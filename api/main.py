@@ -1,3 +1,4 @@
+import asyncio
 import math
 import time
 import tracemalloc
@@ -5,13 +6,22 @@ import subprocess
 import json
 import uuid
 import os
+import re
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Optional, Dict, Any
-from fastapi import FastAPI, HTTPException, Response
-from pydantic import BaseModel, Field
+from typing import List, Optional, Dict, Any, Literal, Tuple, Annotated
+from fastapi import FastAPI, HTTPException, Request, Response, BackgroundTasks
+from fastapi.routing import APIRoute
+from starlette.background import BackgroundTask
+from pydantic import AfterValidator, BaseModel, Field, model_validator
+from decimal import Decimal
 from datetime import datetime
+from collections import OrderedDict
+from functools import wraps
+from contextlib import contextmanager, asynccontextmanager
+from contextvars import ContextVar
 import threading
+from api.worker import call_worker, WorkerError
 
 
 # --- CONFIGURATION ---
@@ -22,14 +32,61 @@ else:
     # Local Windows Path
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
     ROOT_DIR = os.path.dirname(BASE_DIR)
-    ENGINE_PATH = os.path.join(ROOT_DIR, "build", "Debug", "engine.exe")# ---------------------------------------------------------
+    ENGINE_PATH = os.path.join(ROOT_DIR, "build", "Debug", "engine.exe")
+
+# Tax slabs and the 80CCD deduction cap live in one table, shared by the
+# validator (deduction cap) and the C++ engine (slab cascade + rebate).
+TAX_SLABS_PATH = os.environ.get(
+    "TAX_SLABS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "tax_slabs.json")
+)
+
+def load_tax_table(path: str) -> Dict[str, Any]:
+    """Loads the slab table once and normalizes it to ascending slab order."""
+    with open(path) as f:
+        table = json.load(f)
+    table["slabs"] = sorted(table["slabs"], key=lambda s: s["from"])
+    return table
+
+TAX_TABLE = load_tax_table(TAX_SLABS_PATH)
+
+# Distributed mode: comma-separated host:port engine workers (see api/worker.py).
+# Requests with at least SHARD_MIN_TRANSACTIONS valid transactions are split
+# into one time shard per worker; smaller ones stay on the local engine.
+ENGINE_WORKERS = [w.strip() for w in os.environ.get("ENGINE_WORKERS", "").split(",") if w.strip()]
+SHARD_MIN_TRANSACTIONS = int(os.environ.get("SHARD_MIN_TRANSACTIONS", "100000"))
+
+# Engine sessions: a request with "session": true keeps its engine process (and
+# its savings index) alive for later deltas. At most ENGINE_SESSIONS stay open;
+# the least recently used one is closed first, and idle ones are reaped in the
+# background. An engine that takes longer than the response timeout is killed.
+SESSION_STORE_SIZE = int(os.environ.get("ENGINE_SESSIONS", "16"))
+SESSION_IDLE_SECONDS = float(os.environ.get("ENGINE_SESSION_IDLE_SECONDS", "600"))
+SESSION_TIMEOUT_SECONDS = float(os.environ.get("ENGINE_SESSION_TIMEOUT_SECONDS", "30"))
+
+def max_deduction_limit(wage: float) -> float:
+    deduction = TAX_TABLE["deduction"]
+    return min(wage * deduction["rate"], deduction["cap"])
+
+# ---------------------------------------------------------
 # 1. Pydantic Models (Validation Schemas)
 # ---------------------------------------------------------
 
+def whole_paise(amount: float) -> float:
+    """
+    Money carries at most 2 decimals. The engine sums exact integer paise,
+    so a sub-paise amount would be rounded twice on its way to the total.
+    """
+    if not math.isfinite(amount) or Decimal(repr(amount)).as_tuple().exponent < -2:
+        raise ValueError("amount must be a whole number of paise (at most 2 decimal places)")
+    return amount
+
+PaiseAmount = Annotated[float, AfterValidator(whole_paise)]
+
 # Individual API Models
 class Expense(BaseModel):
     date: str
-    amount: float = Field(..., gt=0)
+    amount: PaiseAmount = Field(..., gt=0)
 
 class Transaction(BaseModel):
     id: str
@@ -49,6 +106,17 @@ class Period(BaseModel):
     fixed: Optional[int] = None
     extra: Optional[int] = None
 
+class NormalizedPeriod(BaseModel):
+    # Keys precede the strings so the engine's streaming reader has them
+    # before it reaches start/end and never needs to parse a Q/P string.
+    index: int
+    start_key: int
+    end_key: int
+    start: str
+    end: str
+    fixed: Optional[int] = None
+    extra: Optional[int] = None
+
 class TemporalValidationRequest(BaseModel):
     wage: float
     q_periods: List[Period]
@@ -58,7 +126,21 @@ class TemporalValidationRequest(BaseModel):
 
 class RawTransaction(BaseModel):
     date: str
-    amount: float
+    amount: PaiseAmount
+
+class TransactionDelta(BaseModel):
+    op: Literal["insert", "delete", "update"]
+    date: str
+    amount: Optional[PaiseAmount] = Field(None, gt=0)
+
+    @model_validator(mode="after")
+    def amount_required(self):
+        if self.op != "delete" and self.amount is None:
+            raise ValueError(f"'{self.op}' requires an amount")
+        return self
+
+class DeltaBatch(BaseModel):
+    deltas: List[TransactionDelta]
 
 class ChallengeRequest(BaseModel):
     age: int
@@ -68,6 +150,7 @@ class ChallengeRequest(BaseModel):
     p: List[Period]
     k: List[Period]
     transactions: List[RawTransaction]
+    session: bool = False
 
 # ---------------------------------------------------------
 # 2. Application Setup & Global Metrics
@@ -84,6 +167,146 @@ tracemalloc.start()
 start_time = time.time()
 engine_calls = 0
 
+# ---------------------------------------------------------
+# 2b. Request Profiling (opt-in via X-Profile header or ?profile=1)
+# ---------------------------------------------------------
+
+PROFILE_HEADER = "X-Profile"
+TRACE_STORE_SIZE = 100
+current_profile: ContextVar[Optional["RequestProfile"]] = ContextVar("current_profile", default=None)
+trace_store: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+trace_lock = threading.Lock()
+
+class RequestProfile:
+    """Collects the spans of a single request as Chrome trace events."""
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex
+        self.pid = os.getpid()
+        self.origin_ns = time.perf_counter_ns()
+        self.mark_us: Optional[float] = None
+        self.events: List[Dict[str, Any]] = [
+            {"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": "api"}}
+        ]
+
+    def now_us(self) -> float:
+        return (time.perf_counter_ns() - self.origin_ns) / 1000
+
+    def add_span(self, name: str, start_us: float, dur_us: float, cat: str = "api",
+                 pid: Optional[int] = None, args: Optional[Dict[str, Any]] = None):
+        event = {
+            "name": name, "cat": cat, "ph": "X",
+            "ts": round(start_us, 3), "dur": round(dur_us, 3),
+            "pid": pid if pid is not None else self.pid,
+            "tid": threading.get_ident() if pid is None else 0,
+        }
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+    def add_engine_phases(self, engine_pid: int, spawn_us: float, phases: List[Dict[str, Any]],
+                          peak_rss_kb: Optional[int] = None):
+        """Places the engine's own phase timings, measured from its start, on the trace."""
+        self.events.append({"name": "process_name", "ph": "M", "pid": engine_pid, "args": {"name": "engine"}})
+        for phase in phases:
+            self.add_span(phase["name"], spawn_us + phase["startUs"], phase["durUs"], cat="engine", pid=engine_pid)
+        if peak_rss_kb is not None and phases:
+            end_us = spawn_us + phases[-1]["startUs"] + phases[-1]["durUs"]
+            self.events.append({"name": "peakRssKb", "ph": "C", "ts": round(end_us, 3), "pid": engine_pid,
+                                "args": {"peakRssKb": peak_rss_kb}})
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        return {"traceEvents": self.events, "displayTimeUnit": "ms", "otherData": {"traceId": self.trace_id}}
+
+@contextmanager
+def profile_span(name: str, **args):
+    """Records a span on the active request profile; a no-op when profiling is off."""
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+    start = profile.now_us()
+    try:
+        yield
+    finally:
+        profile.add_span(name, start, profile.now_us() - start, args=args or None)
+
+class ProfiledRoute(APIRoute):
+    """
+    Splits FastAPI's own work around each endpoint into spans: reading the
+    body, JSON decoding plus Pydantic validation (until the endpoint is
+    entered) and response serialization (after it returns).
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        @wraps(endpoint)
+        async def marked_endpoint(*args, **kw):
+            profile = current_profile.get()
+            if profile is not None and profile.mark_us is not None:
+                profile.add_span("request.validate", profile.mark_us, profile.now_us() - profile.mark_us)
+                profile.mark_us = None
+            try:
+                return await endpoint(*args, **kw)
+            finally:
+                if profile is not None:
+                    profile.mark_us = profile.now_us()
+
+        super().__init__(path, marked_endpoint, **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            profile = current_profile.get()
+            if profile is None:
+                return await handler(request)
+            with profile_span("request.body"):
+                await request.body()
+            body_read_us = profile.now_us()
+            profile.mark_us = body_read_us
+            response = await handler(request)
+            # Still at the body mark: the endpoint never ran (rejected by validation).
+            name = "request.validate" if profile.mark_us == body_read_us else "response.serialize"
+            profile.add_span(name, profile.mark_us, profile.now_us() - profile.mark_us)
+            return response
+
+        return route_handler
+
+app.router.route_class = ProfiledRoute
+
+def store_trace(profile: RequestProfile):
+    with trace_lock:
+        trace_store[profile.trace_id] = profile.to_chrome_trace()
+        while len(trace_store) > TRACE_STORE_SIZE:
+            trace_store.popitem(last=False)
+
+@app.middleware("http")
+async def profiling_middleware(request: Request, call_next):
+    flag = request.headers.get(PROFILE_HEADER) or request.query_params.get("profile")
+    if flag not in ("1", "true"):
+        return await call_next(request)
+
+    profile = RequestProfile()
+    token = current_profile.set(profile)
+    try:
+        with profile_span(f"{request.method} {request.url.path}"):
+            response = await call_next(request)
+    finally:
+        current_profile.reset(token)
+
+    store_trace(profile)
+    response.headers["X-Trace-Id"] = profile.trace_id
+    return response
+
+@app.get("/blackrock/challenge/v1/traces/{trace_id}")
+async def get_trace(trace_id: str):
+    """Returns a stored request trace in Chrome trace JSON (load in chrome://tracing or Perfetto)."""
+    with trace_lock:
+        trace = trace_store.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail=f"Trace '{trace_id}' not found.")
+    return trace
+
 # ---------------------------------------------------------
 # 3. Individual APIs (Existing Logic)
 # ---------------------------------------------------------
@@ -91,48 +314,90 @@ engine_calls = 0
 @app.post("/blackrock/challenge/v1/transactions:parse", response_model=List[Transaction])
 async def api_build_transactions(expenses: List[Expense]):
     """Calculates ceiling (multiple of 100) and remanent."""
+    with profile_span("parse.ids"):
+        ids = [f"txn_{idx}_{uuid.uuid4().hex[:4]}" for idx in range(len(expenses))]
+
     transactions = []
-    for idx, exp in enumerate(expenses):
-        ceiling = math.ceil(exp.amount / 100.0) * 100
-        remanent = ceiling - exp.amount
-        transactions.append(Transaction(
-            id=f"txn_{idx}_{uuid.uuid4().hex[:4]}",
-            date=exp.date,
-            amount=exp.amount,
-            ceiling=ceiling,
-            remanent=remanent
-        ))
+    with profile_span("parse.transactions"):
+        for txn_id, exp in zip(ids, expenses):
+            ceiling = math.ceil(exp.amount / 100.0) * 100
+            remanent = ceiling - exp.amount
+            transactions.append(Transaction(
+                id=txn_id,
+                date=exp.date,
+                amount=exp.amount,
+                ceiling=ceiling,
+                remanent=remanent
+            ))
     return transactions
 
 @app.post("/blackrock/challenge/v1/transactions:validator")
 async def api_validate_financials(data: WageData):
     """Validates against 10% annual income or 2L max limit."""
-    valid, invalid, seen_ids = [], [], set()
+    valid, invalid = [], []
     total_invested = 0
-    max_investment = min(data.wage * 0.10, 200000.0)
-
-    for txn in data.transactions:
-        if txn.id in seen_ids:
-            txn.status = "duplicate"
-            invalid.append({
-                "transaction": txn,
-                "reason": f"Transaction ID '{txn.id}' has already been processed."
-            })
-            continue
-            
-        if total_invested + txn.remanent > max_investment:
-            txn.status = "invalid_exceeds_limit"
-            invalid.append({
-                "transaction": txn,
-                "reason": f"Adding {txn.remanent} would exceed your max investment limit of {max_investment}. Current total: {total_invested}."
-            })
-        
-        else:
-            txn.status = "valid"
-            total_invested += txn.remanent
-            valid.append(txn)
-            seen_ids.add(txn.id)
-            
+    max_investment = max_deduction_limit(data.wage)
+    txns = data.transactions
+    n = len(txns)
+
+    # Single hash pass up front: every repeat of an ID is a duplicate,
+    # whether or not its first occurrence is accepted.
+    seen_ids = set()
+    is_duplicate = [False] * n
+    with profile_span("validator.duplicates"):
+        for i, txn in enumerate(txns):
+            if txn.id in seen_ids:
+                is_duplicate[i] = True
+            else:
+                seen_ids.add(txn.id)
+
+    # Running-limit index: min_remaining[i] is the smallest remanent among the
+    # non-duplicate rows from i onward. Once even that exceeds the headroom,
+    # nothing after i can be accepted and the tail is classified in bulk.
+    min_remaining = [math.inf] * (n + 1)
+    with profile_span("validator.limit_index"):
+        for i in range(n - 1, -1, -1):
+            min_remaining[i] = min_remaining[i + 1]
+            if not is_duplicate[i] and txns[i].remanent < min_remaining[i]:
+                min_remaining[i] = txns[i].remanent
+
+    def mark_duplicate(txn: Transaction):
+        txn.status = "duplicate"
+        invalid.append({
+            "transaction": txn,
+            "reason": f"Transaction ID '{txn.id}' has already been processed."
+        })
+
+    with profile_span("validator.classify"):
+        i = 0
+        while i < n and total_invested + min_remaining[i] <= max_investment:
+            txn = txns[i]
+            i += 1
+            if is_duplicate[i - 1]:
+                mark_duplicate(txn)
+                continue
+
+            if total_invested + txn.remanent > max_investment:
+                txn.status = "invalid_exceeds_limit"
+                invalid.append({
+                    "transaction": txn,
+                    "reason": f"Adding {txn.remanent} would exceed your max investment limit of {max_investment}. Current total: {total_invested}."
+                })
+            else:
+                txn.status = "valid"
+                total_invested += txn.remanent
+                valid.append(txn)
+
+        # Saturated tail: the total can no longer change, so one reason is shared.
+        saturated_reason = f"Max investment limit of {max_investment} is saturated. Current total: {total_invested}."
+        for j in range(i, n):
+            txn = txns[j]
+            if is_duplicate[j]:
+                mark_duplicate(txn)
+            else:
+                txn.status = "invalid_exceeds_limit"
+                invalid.append({"transaction": txn, "reason": saturated_reason})
+
     return {
         "valid_transactions": valid, 
         "invalid_transactions": invalid,
@@ -141,89 +406,165 @@ async def api_validate_financials(data: WageData):
             "limit": max_investment
         }
     }
-@app.post("/blackrock/challenge/v1/transactions:filter")
-async def api_temporal_validate(data: TemporalValidationRequest):
-    """Checks date formats and k-period year constraints with descriptive error messages."""
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def date_key(dt: datetime) -> int:
+    """YYYYMMDDHHMMSS as an int — the same key the engine's parse_date() builds."""
+    return ((((dt.year * 100 + dt.month) * 100 + dt.day) * 100 + dt.hour) * 100 + dt.minute) * 100 + dt.second
+
+def engine_date_key(value: str) -> int:
+    """Digits-only key, exactly as the engine's parse_date() reads a string."""
+    return int(re.sub(r"[^0-9]", "", value) or 0)
+
+def format_key(key: int) -> str:
+    s = f"{key:014d}"
+    return f"{s[0:4]}-{s[4:6]}-{s[6:8]} {s[8:10]}:{s[10:12]}:{s[12:14]}"
+
+def normalize_periods(periods: List[Period], name: str) -> Tuple[List[NormalizedPeriod], List[Dict[str, str]]]:
+    """
+    Parses every period boundary exactly once into int64 keys.
+    Q/P come back stable-sorted by start key; K keeps request order since the
+    response echoes it. Malformed periods are reported but still forwarded,
+    keyed by their digits exactly as the engine used to key them.
+    """
+    normalized, errors = [], []
+    for i, p in enumerate(periods):
+        try:
+            start_key = date_key(datetime.strptime(p.start, DATE_FORMAT))
+            end_key = date_key(datetime.strptime(p.end, DATE_FORMAT))
+        except ValueError:
+            errors.append({
+                "period": f"{name}_{i}",
+                "reason": "One or more timestamps in this period have an invalid format."
+            })
+            start_key = engine_date_key(p.start)
+            end_key = engine_date_key(p.end)
+        normalized.append(NormalizedPeriod(
+            index=i, start=p.start, end=p.end, start_key=start_key, end_key=end_key,
+            fixed=p.fixed, extra=p.extra
+        ))
+
+    if name != "k":
+        normalized.sort(key=lambda p: p.start_key)
+    return normalized, errors
+
+def internal_temporal_validate(data: TemporalValidationRequest) -> Dict[str, Any]:
+    """Checks date formats and k-period year constraints; also returns the normalized periods."""
     valid_txns = []
     invalid_txns = []
     period_errors = []
-    seen_ts = set()
-    parsed_dates = []
-
-    for txn in data.transactions:
-        if txn.status != "valid":
-            invalid_txns.append({
-                "transaction": txn,
-                "reason": f"Transaction already has status: {txn.status}"
-            })
-            continue
-            
-        try:
-            dt = datetime.strptime(txn.date, "%Y-%m-%d %H:%M:%S")
-            
-            if txn.date in seen_ts:
+    parsed_keys = []
+
+    # Feeds are almost always time-ordered: while they are, duplicates are just
+    # equal neighbours and min/max are the ends. The first out-of-order row
+    # switches to a hash set built once from the keys accepted so far.
+    transactions_sorted = True
+    prev_key = -1
+    seen_keys = None
+
+    with profile_span("filter.transactions"):
+        for txn in data.transactions:
+            if txn.status != "valid":
+                invalid_txns.append({
+                    "transaction": txn,
+                    "reason": f"Transaction already has status: {txn.status}"
+                })
+                continue
+
+            try:
+                dt = datetime.strptime(txn.date, DATE_FORMAT)
+            except ValueError:
+                txn.status = "invalid_timestamp_format"
+                invalid_txns.append({
+                    "transaction": txn,
+                    "reason": f"Date '{txn.date}' does not match required format YYYY-MM-DD HH:MM:SS"
+                })
+                continue
+
+            key = date_key(dt)
+            # strptime accepts unpadded fields, which the engine would key by raw
+            # digits in a different order, so those also leave the sorted path.
+            if transactions_sorted and (key < prev_key or len(txn.date) != 19):
+                transactions_sorted = False
+                seen_keys = set(parsed_keys)
+
+            duplicate = (key == prev_key) if transactions_sorted else (key in seen_keys)
+            if duplicate:
                 txn.status = "invalid_duplicate_timestamp"
                 invalid_txns.append({
                     "transaction": txn,
                     "reason": f"A transaction at timestamp {txn.date} already exists."
                 })
+                continue
+
+            if seen_keys is not None:
+                seen_keys.add(key)
+            prev_key = key
+            parsed_keys.append(key)
+            valid_txns.append(txn)
+
+    with profile_span("filter.periods"):
+        periods = {}
+        malformed = set()
+        for name, raw in (("q", data.q_periods), ("p", data.p_periods), ("k", data.k_periods)):
+            periods[name], errors = normalize_periods(raw, name)
+            malformed.update(e["period"] for e in errors)
+            period_errors.extend(errors)
+
+    with profile_span("filter.period_checks"):
+        if parsed_keys:
+            if transactions_sorted:
+                min_t, max_t = parsed_keys[0], parsed_keys[-1]
             else:
-                seen_ts.add(txn.date)
-                parsed_dates.append(dt)
-                valid_txns.append(txn)
-                
-        except ValueError:
-            txn.status = "invalid_timestamp_format"
-            invalid_txns.append({
-                "transaction": txn,
-                "reason": f"Date '{txn.date}' does not match required format YYYY-MM-DD HH:MM:SS"
-            })
+                min_t, max_t = min(parsed_keys), max(parsed_keys)
 
-    if parsed_dates:
-        min_t, max_t = min(parsed_dates), max(parsed_dates)
-        
-        def check_bounds(periods: List[Period], name: str):
-            for i, p in enumerate(periods):
-                try:
-                    s_dt = datetime.strptime(p.start, "%Y-%m-%d %H:%M:%S")
-                    e_dt = datetime.strptime(p.end, "%Y-%m-%d %H:%M:%S")
-                    
-                    if s_dt > e_dt:
+            for name in ("q", "p", "k"):
+                for p in periods[name]:
+                    label = f"{name}_{p.index}"
+                    if label in malformed:
+                        continue
+
+                    if p.start_key > p.end_key:
                         period_errors.append({
-                            "period": f"{name}_{i}",
+                            "period": label,
                             "reason": f"Start date ({p.start}) is after end date ({p.end})."
                         })
-                    
-                    if s_dt < min_t or e_dt > max_t:
+
+                    if p.start_key < min_t or p.end_key > max_t:
                         period_errors.append({
-                            "period": f"{name}_{i}",
-                            "reason": f"Period is out of bounds for the current transaction set ({min_t} to {max_t})."
+                            "period": label,
+                            "reason": f"Period is out of bounds for the current transaction set ({format_key(min_t)} to {format_key(max_t)})."
                         })
-                        
-                    if name == "k" and s_dt.year != e_dt.year:
+
+                    start_year, end_year = p.start_key // 10**10, p.end_key // 10**10
+                    if name == "k" and start_year != end_year:
                         period_errors.append({
-                            "period": f"k_{i}",
-                            "reason": f"K-period spans multiple years ({s_dt.year} to {e_dt.year}), which is forbidden."
+                            "period": label,
+                            "reason": f"K-period spans multiple years ({start_year} to {end_year}), which is forbidden."
                         })
-                        
-                except ValueError:
-                    period_errors.append({
-                        "period": f"{name}_{i}",
-                        "reason": "One or more timestamps in this period have an invalid format."
-                    })
-
-        check_bounds(data.q_periods, "q")
-        check_bounds(data.p_periods, "p")
-        check_bounds(data.k_periods, "k")
-    else:
-        period_errors.append({
-            "period": "global",
-            "reason": "No valid transactions available to establish temporal bounds."
-        })
+        else:
+            period_errors.append({
+                "period": "global",
+                "reason": "No valid transactions available to establish temporal bounds."
+            })
 
     return {
         "valid_transactions": valid_txns,
         "invalid_transactions": invalid_txns,
+        "period_errors": period_errors,
+        "transactions_sorted": transactions_sorted,
+        "periods": periods
+    }
+
+@app.post("/blackrock/challenge/v1/transactions:filter")
+async def api_temporal_validate(data: TemporalValidationRequest):
+    """Checks date formats and k-period year constraints with descriptive error messages."""
+    filtered = internal_temporal_validate(data)
+    return {
+        "valid_transactions": filtered["valid_transactions"],
+        "invalid_transactions": filtered["invalid_transactions"],
+        "period_errors": filtered["period_errors"],
+        "transactions_sorted": filtered["transactions_sorted"],
     }
 # ---------------------------------------------------------
 # 4. Composite Orchestrator Logic
@@ -250,38 +591,329 @@ def internal_build_transactions(raw_txns: List[RawTransaction]) -> List[Transact
         ))
     return processed
 
+def shard_engine_payload(payload: Dict[str, Any], n_shards: int) -> List[Dict[str, Any]]:
+    """
+    Splits an engine payload into time-contiguous shards of transactions.
+    Each shard carries the Q/P periods overlapping its time range, which seeds
+    its sweep with the boundary state a single run would have at that point.
+    """
+    txns = sorted(payload["transactions"], key=lambda t: engine_date_key(t["date"]))
+    if not txns:
+        return []
+
+    size = math.ceil(len(txns) / n_shards)
+    shards = []
+    for i in range(0, len(txns), size):
+        chunk = txns[i:i + size]
+        lo, hi = engine_date_key(chunk[0]["date"]), engine_date_key(chunk[-1]["date"])
+
+        # An inverted P (start > end) is live, negatively, between its end and start
+        # events; an inverted Q is never removed, so it stays live from its start on.
+        def p_live(p: Dict[str, Any]) -> bool:
+            return min(p["start_key"], p["end_key"]) <= hi and max(p["start_key"], p["end_key"]) >= lo
+
+        def q_live(p: Dict[str, Any]) -> bool:
+            return p["start_key"] <= hi and (p["end_key"] >= lo or p["start_key"] > p["end_key"])
+
+        shards.append({
+            **payload,
+            "transactions": chunk,
+            "q_periods": [p for p in payload["q_periods"] if q_live(p)],
+            "p_periods": [p for p in payload["p_periods"] if p_live(p)],
+            "sorted": True,
+            "partial": True,
+            "profile": False,
+        })
+    return shards
+
+async def merge_shards(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Runs the shards on the worker pool and folds their partial sums into a merge payload."""
+    shards = shard_engine_payload(payload, len(ENGINE_WORKERS))
+    with profile_span("engine.shards", shards=len(shards)):
+        partials = await asyncio.gather(*(
+            call_worker(worker, json.dumps(shard).encode())
+            for worker, shard in zip(ENGINE_WORKERS, shards)
+        ))
+
+    # Partials are exact integers (amounts in paise), so the merged totals do
+    # not depend on how the set was split.
+    merged = {"totalTransactionPaise": 0, "totalCeiling": 0, "kInvested": [0] * len(payload["k_periods"])}
+    for raw in partials:
+        part = json.loads(raw)
+        merged["totalTransactionPaise"] += part["totalTransactionPaise"]
+        merged["totalCeiling"] += part["totalCeiling"]
+        merged["kInvested"] = [a + b for a, b in zip(merged["kInvested"], part["kInvested"])]
+
+    return {**payload, "transactions": [], "q_periods": [], "p_periods": [], "merge": merged}
+
 async def run_orchestrator(data: ChallengeRequest, mode: str):
     global engine_calls
-    expenses = [Expense(date=t.date, amount=t.amount) for t in data.transactions]
-    built = await api_build_transactions(expenses)
+    profile = current_profile.get()
+
+    with profile_span("build", transactions=len(data.transactions)):
+        expenses = [Expense(date=t.date, amount=t.amount) for t in data.transactions]
+        built = await api_build_transactions(expenses)
     
-    wage_data = WageData(wage=data.wage, transactions=built)
-    validated = await api_validate_financials(wage_data)
+    with profile_span("validate"):
+        wage_data = WageData(wage=data.wage, transactions=built)
+        validated = await api_validate_financials(wage_data)
     
-    temp_req = TemporalValidationRequest(
-        wage=data.wage, q_periods=data.q, p_periods=data.p, k_periods=data.k, 
-        transactions=validated["valid_transactions"]
-    )
-    filtered = await api_temporal_validate(temp_req)
-
-    engine_payload = {
-        "mode": mode,
-        "age": data.age,
-        "wage": data.wage,
-        "inflation": data.inflation,
-        "q_periods": [p.model_dump() for p in data.q],
-        "p_periods": [p.model_dump() for p in data.p],
-        "k_periods": [p.model_dump() for p in data.k],
-        "transactions": [t.model_dump() for t in filtered["valid_transactions"]]
-    }
+    with profile_span("filter"):
+        temp_req = TemporalValidationRequest(
+            wage=data.wage, q_periods=data.q, p_periods=data.p, k_periods=data.k, 
+            transactions=validated["valid_transactions"]
+        )
+        filtered = internal_temporal_validate(temp_req)
+        periods = filtered["periods"]
+
+    with profile_span("payload"):
+        engine_payload = {
+            "mode": mode,
+            "age": data.age,
+            "wage": data.wage,
+            "inflation": data.inflation,
+            "tax": TAX_TABLE,
+            "q_periods": [p.model_dump() for p in periods["q"]],
+            "p_periods": [p.model_dump() for p in periods["p"]],
+            "k_periods": [p.model_dump() for p in periods["k"]],
+            "transactions": [t.model_dump() for t in filtered["valid_transactions"]],
+            "sorted": filtered["transactions_sorted"],
+            # A session engine keeps stdin open, so it cannot report phases on exit.
+            "profile": profile is not None and not data.session,
+            "session": data.session
+        }
+
+    # A session keeps its index in one local engine process, so it never shards.
+    if ENGINE_WORKERS and not data.session and len(engine_payload["transactions"]) >= SHARD_MIN_TRANSACTIONS:
+        try:
+            engine_payload = await merge_shards(engine_payload)
+        except (WorkerError, OSError) as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    with profile_span("serialize"):
+        engine_input = json.dumps(engine_payload)
 
     engine_calls += 1
-    process = subprocess.Popen([ENGINE_PATH], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    stdout, stderr = process.communicate(input=json.dumps(engine_payload))
+    if data.session:
+        return await open_session(engine_input, filtered["valid_transactions"], validated["summary"]["limit"])
+
+    with profile_span("engine.spawn"):
+        process = subprocess.Popen([ENGINE_PATH], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    spawn_us = profile.now_us() if profile else 0
+    with profile_span("engine.run"):
+        stdout, stderr = process.communicate(input=engine_input)
 
     if process.returncode != 0: raise HTTPException(status_code=500, detail=stderr)
+
+    # With profiling on, the engine reports its phase timings on stderr.
+    if profile and stderr:
+        try:
+            engine_profile = json.loads(stderr)
+            profile.add_engine_phases(process.pid, spawn_us, engine_profile["phases"], engine_profile.get("peakRssKb"))
+        except (ValueError, KeyError):
+            pass
     return Response(content=stdout, media_type="application/json")
 
+# ---------------------------------------------------------
+# 4b. Engine Sessions (incremental insert/update/delete)
+# ---------------------------------------------------------
+
+SESSION_HEADER = "X-Session-Id"
+engine_sessions: "OrderedDict[str, EngineSession]" = OrderedDict()
+session_lock = threading.Lock()
+
+class EngineSession:
+    """
+    An engine process left running after its first result, plus the
+    remanent of every transaction it holds (by engine key) so that deltas
+    are checked against the same rules as the base set before they reach it.
+    """
+
+    def __init__(self, process: subprocess.Popen, transactions: List[Transaction], limit: float):
+        self.session_id = uuid.uuid4().hex
+        self.process = process
+        self.remanents = {engine_date_key(t.date): t.remanent for t in transactions}
+        self.total_invested = sum(self.remanents.values())
+        self.limit = limit
+        self.lock = asyncio.Lock()
+        self.closed = False
+        self.last_used = time.monotonic()
+
+    def _exchange(self, document: str) -> bytes:
+        """Blocking pipe round trip; runs on an executor thread, never on the event loop."""
+        self.process.stdin.write(document.encode() + b"\n")
+        self.process.stdin.flush()
+        header = self.process.stdout.readline()
+        if not header:
+            raise EOFError
+        return self.process.stdout.read(int(header))
+
+    async def exchange(self, document: str) -> bytes:
+        """
+        Sends one JSON document to the engine and waits for its framed result.
+        An engine that fails or outlives SESSION_TIMEOUT_SECONDS is killed;
+        the caller drops the session.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(None, self._exchange, document), SESSION_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            await self.close(kill=True)
+            raise HTTPException(status_code=500, detail=f"Session engine did not respond within {SESSION_TIMEOUT_SECONDS}s.")
+        except (OSError, EOFError, ValueError):
+            await self.close(kill=True)
+            raise HTTPException(status_code=500, detail=self.process.stderr.read().decode(errors="replace"))
+
+    def check_deltas(self, deltas: List[TransactionDelta]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Applies the filter's date and duplicate checks and the validator's cap
+        to each delta in order; accepted ones update the running total.
+        """
+        accepted, invalid = [], []
+        for delta in deltas:
+            try:
+                datetime.strptime(delta.date, DATE_FORMAT)
+            except ValueError:
+                invalid.append({
+                    "delta": delta,
+                    "reason": f"Date '{delta.date}' does not match required format YYYY-MM-DD HH:MM:SS"
+                })
+                continue
+
+            key = engine_date_key(delta.date)
+            old = self.remanents.get(key)
+            remanent = 0 if delta.op == "delete" else math.ceil(delta.amount / 100.0) * 100 - delta.amount
+            if delta.op == "insert" and old is not None:
+                reason = f"A transaction at timestamp {delta.date} already exists."
+            elif delta.op != "insert" and old is None:
+                reason = f"No transaction at timestamp {delta.date} to {delta.op}."
+            elif self.total_invested - (old or 0) + remanent > self.limit:
+                reason = f"Adding {remanent} would exceed your max investment limit of {self.limit}. Current total: {self.total_invested}."
+            else:
+                reason = None
+
+            if reason:
+                invalid.append({"delta": delta, "reason": reason})
+                continue
+
+            if delta.op == "delete":
+                del self.remanents[key]
+            else:
+                self.remanents[key] = remanent
+            self.total_invested += remanent - (old or 0)
+            accepted.append(delta.model_dump(exclude_none=True))
+        return accepted, invalid
+
+    async def close(self, kill: bool = False):
+        """Closing stdin ends the engine's read loop; a stuck or hung engine is killed."""
+        self.closed = True
+        if self.process.poll() is not None:
+            return
+        loop = asyncio.get_running_loop()
+        if not kill:
+            try:
+                self.process.stdin.close()
+                await asyncio.wait_for(loop.run_in_executor(None, self.process.wait), 1)
+                return
+            except (OSError, asyncio.TimeoutError):
+                pass
+        self.process.kill()
+        await loop.run_in_executor(None, self.process.wait)
+
+def pop_stale_sessions() -> List[EngineSession]:
+    """Unlinks sessions idle past SESSION_IDLE_SECONDS and the least recently used beyond the store size."""
+    now = time.monotonic()
+    with session_lock:
+        stale = [s for s in engine_sessions.values() if now - s.last_used > SESSION_IDLE_SECONDS]
+        for s in stale:
+            del engine_sessions[s.session_id]
+        while len(engine_sessions) > SESSION_STORE_SIZE:
+            stale.append(engine_sessions.popitem(last=False)[1])
+    return stale
+
+async def close_sessions(sessions: List[EngineSession]):
+    for s in sessions:
+        async with s.lock:
+            await s.close()
+
+async def reap_sessions():
+    """Closes idle sessions even when no request arrives to notice them."""
+    while True:
+        await asyncio.sleep(min(SESSION_IDLE_SECONDS, 60))
+        await close_sessions(pop_stale_sessions())
+
+@asynccontextmanager
+async def session_lifespan(app: FastAPI):
+    reaper = asyncio.create_task(reap_sessions())
+    try:
+        yield
+    finally:
+        reaper.cancel()
+        with session_lock:
+            remaining = list(engine_sessions.values())
+            engine_sessions.clear()
+        await close_sessions(remaining)
+
+app.router.lifespan_context = session_lifespan
+
+async def open_session(engine_input: str, transactions: List[Transaction], limit: float) -> Response:
+    with profile_span("engine.spawn"):
+        process = subprocess.Popen([ENGINE_PATH], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    session = EngineSession(process, transactions, limit)
+    with profile_span("engine.run"):
+        stdout = await session.exchange(engine_input)
+
+    with session_lock:
+        engine_sessions[session.session_id] = session
+    # Evicted engines are shut down after the response is sent.
+    return Response(content=stdout, media_type="application/json", headers={SESSION_HEADER: session.session_id},
+                    background=BackgroundTask(close_sessions, pop_stale_sessions()))
+
+def find_session(session_id: str, background_tasks: BackgroundTasks) -> EngineSession:
+    background_tasks.add_task(close_sessions, pop_stale_sessions())
+    with session_lock:
+        session = engine_sessions.get(session_id)
+        if session is not None:
+            engine_sessions.move_to_end(session_id)
+            session.last_used = time.monotonic()
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found.")
+    return session
+
+@app.post("/blackrock/challenge/v1/sessions/{session_id}/deltas")
+async def apply_session_deltas(session_id: str, batch: DeltaBatch, background_tasks: BackgroundTasks):
+    """Applies insert/update/delete corrections to a session and returns its updated result."""
+    global engine_calls
+    session = find_session(session_id, background_tasks)
+    async with session.lock:
+        if session.closed:
+            raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found.")
+        with profile_span("deltas.check", deltas=len(batch.deltas)):
+            accepted, invalid = session.check_deltas(batch.deltas)
+        engine_calls += 1
+        with profile_span("engine.deltas", accepted=len(accepted)):
+            try:
+                stdout = await session.exchange(json.dumps({"deltas": accepted}))
+            except HTTPException:
+                with session_lock:
+                    engine_sessions.pop(session_id, None)
+                raise
+
+    result = json.loads(stdout)
+    result["invalid_deltas"] = invalid
+    return result
+
+@app.delete("/blackrock/challenge/v1/sessions/{session_id}")
+async def close_session(session_id: str):
+    """Stops a session's engine; sessions left open are also closed when idle or evicted."""
+    with session_lock:
+        session = engine_sessions.pop(session_id, None)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found.")
+    async with session.lock:
+        await session.close()
+    return {"session_id": session_id, "status": "closed"}
+
 # ---------------------------------------------------------
 # 5. Final Composite Endpoints
 # ---------------------------------------------------------
@@ -0,0 +1,102 @@
+"""
+Engine worker node for distributed execution.
+
+A worker accepts one engine payload per TCP connection, runs it through the
+local C++ engine and sends the engine's stdout back. Frames are a 4-byte
+big-endian length followed by the body; response bodies start with a status
+byte (b"0" ok, b"1" engine error) so the worker never has to parse JSON.
+
+Run several on one host for local testing:
+    python -m api.worker --port 6001
+    python -m api.worker --port 6002
+    ENGINE_WORKERS=127.0.0.1:6001,127.0.0.1:6002 uvicorn api.main:app --port 5477
+"""
+import argparse
+import asyncio
+import os
+
+STATUS_OK = b"0"
+STATUS_ERROR = b"1"
+
+
+class WorkerError(Exception):
+    pass
+
+
+async def read_frame(reader: asyncio.StreamReader) -> bytes:
+    header = await reader.readexactly(4)
+    return await reader.readexactly(int.from_bytes(header, "big"))
+
+
+async def write_frame(writer: asyncio.StreamWriter, body: bytes):
+    writer.write(len(body).to_bytes(4, "big") + body)
+    await writer.drain()
+
+
+async def call_worker(address: str, payload: bytes) -> bytes:
+    """Sends one payload to a worker at host:port and returns the engine stdout."""
+    host, port = address.rsplit(":", 1)
+    reader, writer = await asyncio.open_connection(host, int(port))
+    try:
+        await write_frame(writer, payload)
+        body = await read_frame(reader)
+    except (asyncio.IncompleteReadError, ConnectionResetError):
+        raise WorkerError(f"Worker {address} closed the connection without a response")
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+    if body[:1] != STATUS_OK:
+        raise WorkerError(f"Worker {address} failed: {body[1:].decode(errors='replace')}")
+    return body[1:]
+
+
+async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, engine_path: str):
+    try:
+        payload = await read_frame(reader)
+        try:
+            process = await asyncio.create_subprocess_exec(
+                engine_path,
+                stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+        except OSError as e:
+            await write_frame(writer, STATUS_ERROR + f"Could not start engine {engine_path}: {e}".encode())
+            return
+        stdout, stderr = await process.communicate(payload)
+        if process.returncode == 0:
+            await write_frame(writer, STATUS_OK + stdout)
+        else:
+            await write_frame(writer, STATUS_ERROR + stderr)
+    except asyncio.IncompleteReadError:
+        pass
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+async def serve(host: str, port: int, engine_path: str):
+    server = await asyncio.start_server(
+        lambda r, w: handle_connection(r, w, engine_path), host, port
+    )
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="C++ engine worker node")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--engine", default=os.environ.get("ENGINE_PATH"),
+                        help="Engine binary (defaults to the API's resolved ENGINE_PATH)")
+    args = parser.parse_args()
+
+    engine_path = args.engine
+    if engine_path is None:
+        from api.main import ENGINE_PATH
+        engine_path = ENGINE_PATH
+
+    asyncio.run(serve(args.host, args.port, engine_path))
+
+
+if __name__ == "__main__":
+    main()
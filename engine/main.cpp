@@ -2,12 +2,21 @@
 #include <vector>
 #include <string>
 #include <algorithm>
-#include <set>
+#include <functional>
 #include <cmath>
-#include <iomanip>
-#include "nlohmann/json.hpp" 
+#include <charconv>
+#include <map>
+#include "nlohmann/json.hpp"
 #include <chrono>
 
+#ifdef _WIN32
+#define NOMINMAX
+#include <windows.h>
+#include <psapi.h>
+#else
+#include <sys/resource.h>
+#endif
+
 using json = nlohmann::ordered_json;
 using namespace std;
 
@@ -19,16 +28,22 @@ long long parse_date(const string& s) {
     return res;
 }
 
+// ---------------------------------------------------------
+// Engine structures
+// ---------------------------------------------------------
+
+enum class DeltaOp { Insert, Delete, Update };
+
 struct Event {
     long long time;
-    int type; 
+    int type;
     int id;
     long long val;
     long long q_start;
 
     bool operator<(const Event& other) const {
         if (time != other.time) return time < other.time;
-        return type < other.type; 
+        return type < other.type;
     }
 };
 
@@ -38,172 +53,931 @@ struct Transaction {
     long long ceiling;
     long long final_remanent;
     int original_id;
+    long long amount_paise;
+};
+
+// Fenwick tree over time buckets: K-window totals are two prefix queries and
+// every correction is a single O(log N) point update.
+struct Fenwick {
+    vector<long long> tree;
+
+    void build(const vector<long long>& vals) {
+        tree.assign(vals.size() + 1, 0);
+        for (size_t i = 1; i <= vals.size(); ++i) {
+            tree[i] += vals[i - 1];
+            size_t parent = i + (i & (~i + 1));
+            if (parent < tree.size()) tree[parent] += tree[i];
+        }
+    }
+
+    void add(size_t idx, long long delta) {
+        for (size_t i = idx + 1; i < tree.size(); i += i & (~i + 1)) tree[i] += delta;
+    }
+
+    long long prefix(size_t n) const {
+        long long sum = 0;
+        for (size_t i = n; i > 0; i -= i & (~i + 1)) sum += tree[i];
+        return sum;
+    }
+
+    long long range(size_t l, size_t r) const {
+        return prefix(r) - prefix(l);
+    }
+};
+
+struct Bucket {
+    long long remanent = 0;
+    long long amount_paise = 0;
+    long long ceiling = 0;
 };
 
-vector<long long> q_fixed_amounts;
+// Savings per unique timestamp. Base timestamps sit in sorted arrays behind
+// the Fenwick tree; a timestamp first seen in a session delta goes to a small
+// overflow map, folded back into the arrays once it outgrows sqrt(N).
+struct SavingsIndex {
+    vector<long long> times;
+    vector<long long> remanent;
+    vector<long long> amount_paise;
+    vector<long long> ceiling;
+    Fenwick tree;
+    map<long long, Bucket> overflow;
+
+    void reserve(size_t n) {
+        times.reserve(n);
+        remanent.reserve(n);
+        amount_paise.reserve(n);
+        ceiling.reserve(n);
+    }
+
+    Bucket get(long long time) const {
+        auto it = lower_bound(times.begin(), times.end(), time);
+        if (it != times.end() && *it == time) {
+            size_t i = distance(times.begin(), it);
+            return {remanent[i], amount_paise[i], ceiling[i]};
+        }
+        auto extra = overflow.find(time);
+        return extra == overflow.end() ? Bucket{} : extra->second;
+    }
+
+    void set(long long time, const Bucket& b) {
+        auto it = lower_bound(times.begin(), times.end(), time);
+        if (it != times.end() && *it == time) {
+            size_t i = distance(times.begin(), it);
+            tree.add(i, b.remanent - remanent[i]);
+            remanent[i] = b.remanent;
+            amount_paise[i] = b.amount_paise;
+            ceiling[i] = b.ceiling;
+            return;
+        }
+        overflow[time] = b;
+        if (overflow.size() > 64 + (size_t)sqrt((double)times.size())) compact();
+    }
 
-double calculate_tax(double income) {
-    double tax = 0;
-    if (income > 1500000) { tax += (income - 1500000) * 0.30; income = 1500000; }
-    if (income > 1200000) { tax += (income - 1200000) * 0.20; income = 1200000; }
-    if (income > 1000000) { tax += (income - 1000000) * 0.15; income = 1000000; }
-    if (income > 700000)  { tax += (income - 700000) * 0.10; }
-    return tax;
+    long long window(long long start, long long end) const {
+        auto it_start = lower_bound(times.begin(), times.end(), start);
+        auto it_end = upper_bound(times.begin(), times.end(), end);
+        long long invested = 0;
+        if (it_start < it_end) {
+            invested = tree.range(distance(times.begin(), it_start), distance(times.begin(), it_end));
+        }
+        for (auto it = overflow.lower_bound(start); it != overflow.end() && it->first <= end; ++it) {
+            invested += it->second.remanent;
+        }
+        return invested;
+    }
+
+    // Linear merge of the overflow into the sorted arrays, then one rebuild.
+    void compact() {
+        size_t n = times.size() + overflow.size();
+        SavingsIndex merged;
+        merged.reserve(n);
+        size_t i = 0;
+        auto take_base = [&]() {
+            merged.times.push_back(times[i]);
+            merged.remanent.push_back(remanent[i]);
+            merged.amount_paise.push_back(amount_paise[i]);
+            merged.ceiling.push_back(ceiling[i]);
+            ++i;
+        };
+        for (const auto& entry : overflow) {
+            while (i < times.size() && times[i] < entry.first) take_base();
+            merged.times.push_back(entry.first);
+            merged.remanent.push_back(entry.second.remanent);
+            merged.amount_paise.push_back(entry.second.amount_paise);
+            merged.ceiling.push_back(entry.second.ceiling);
+        }
+        while (i < times.size()) take_base();
+
+        times.swap(merged.times);
+        remanent.swap(merged.remanent);
+        amount_paise.swap(merged.amount_paise);
+        ceiling.swap(merged.ceiling);
+        overflow.clear();
+        tree.build(remanent);
+    }
+};
+
+// Working storage for one run. The reader appends each transaction and its
+// sweep event here as it streams past, so the input is held exactly once;
+// everything else is reserved from the parsed counts before the sweep.
+struct EngineArena {
+    vector<Transaction> txns;
+    vector<Event> events;
+    vector<long long> q_fixed_amounts;
+    // Active Q periods as a min-heap on (-start, id) with lazy removal;
+    // q_state is 0 = not started, 1 = active, 2 = ended.
+    vector<pair<long long, int>> active_q;
+    vector<char> q_state;
+    SavingsIndex index;
+    vector<long long> k_invested;
+    vector<double> k_deductions;
+    vector<double> k_rebates;
+    string out;
+
+    void reserve(size_t q, size_t p, size_t k) {
+        size_t n = txns.size();
+        events.reserve(n + 2 * (q + p));
+        q_fixed_amounts.reserve(q);
+        active_q.reserve(q);
+        q_state.assign(q, 0);
+        index.reserve(n);
+        k_invested.reserve(k);
+        k_deductions.reserve(k);
+        k_rebates.reserve(k);
+        out.reserve(256 + 192 * k);
+    }
+};
+
+// ---------------------------------------------------------
+// Input, filled straight from the JSON stream (no DOM)
+// ---------------------------------------------------------
+
+// A session correction, keyed by timestamp like the transaction it targets.
+struct RawDelta {
+    DeltaOp op = DeltaOp::Update;
+    long long time = 0;
+    double amount = 0;
+    bool has_op = false, has_date = false, has_amount = false;
+};
+
+// Periods arrive pre-normalized by the API with int64 keys ahead of the
+// strings, so Q/P strings are skipped. Raw callers that only send strings
+// are keyed with parse_date once the period object closes. K always keeps
+// its strings, since the response echoes them.
+struct RawPeriod {
+    string start, end;
+    long long start_key = 0, end_key = 0;
+    bool has_start_key = false, has_end_key = false;
+    long long value = 0;
+    bool has_value = false;
+};
+
+struct EngineInput {
+    string mode;
+    int age = 0;
+    double wage = 0;
+    double inflation = 0;
+    bool has_mode = false, has_age = false, has_wage = false, has_inflation = false;
+    bool profile = false;
+    bool presorted = false;
+    bool partial = false;
+    bool session = false;
+
+    // The slab table and 80CCD deduction come from api/tax_slabs.json; the
+    // engine has no copy of its own.
+    bool has_tax = false, has_deduction_rate = false, has_deduction_cap = false;
+    vector<pair<double, double>> tax_slabs;
+    double deduction_rate = 0;
+    double deduction_cap = 0;
+
+    bool has_merge = false;
+    long long merge_amount_paise = 0;
+    long long merge_ceiling = 0;
+    vector<long long> merge_k_invested;
+
+    vector<RawDelta> deltas;
+    vector<RawPeriod> q_periods, p_periods, k_periods;
+};
+
+// SAX handler that routes each scalar by its position in the payload. The
+// stack holds the key every open container was opened under. Transactions
+// go straight into the arena; a malformed one stops the parse with an error.
+class InputReader : public nlohmann::json_sax<json> {
+public:
+    InputReader(EngineInput& input, EngineArena& arena) : in(input), arena(arena) {}
+
+    std::string error;
+
+    bool null() override { return true; }
+
+    bool boolean(bool val) override {
+        if (stack.size() == 1) {
+            if (current_key == "profile") in.profile = val;
+            else if (current_key == "sorted") in.presorted = val;
+            else if (current_key == "partial") in.partial = val;
+            else if (current_key == "session") in.session = val;
+        }
+        return true;
+    }
+
+    bool number_integer(number_integer_t val) override { return number((double)val, val); }
+    bool number_unsigned(number_unsigned_t val) override { return number((double)val, (long long)val); }
+    bool number_float(number_float_t val, const string_t&) override { return number(val, (long long)val); }
+
+    bool string(string_t& val) override {
+        size_t depth = stack.size();
+        if (depth == 1) {
+            if (current_key == "mode") { in.mode = val; in.has_mode = true; }
+            return true;
+        }
+        if (depth != 3 || !stack[1].is_array) return true;
+
+        const std::string& section = stack[1].key;
+        if (section == "transactions") {
+            if (current_key == "date") { arena.txns.back().time = parse_date(val); txn_has_date = true; }
+        } else if (section == "deltas") {
+            RawDelta& d = in.deltas.back();
+            if (current_key == "date") { d.time = parse_date(val); d.has_date = true; }
+            else if (current_key == "op") {
+                if (val == "insert") d.op = DeltaOp::Insert;
+                else if (val == "delete") d.op = DeltaOp::Delete;
+                else if (val == "update") d.op = DeltaOp::Update;
+                else {
+                    error = "deltas[" + to_string(in.deltas.size() - 1) + "] has unknown op '" + val + "'";
+                    return false;
+                }
+                d.has_op = true;
+            }
+        } else if (RawPeriod* p = current_period()) {
+            bool keep_text = (section == "k_periods");
+            if (current_key == "start" && (keep_text || !p->has_start_key)) p->start = val;
+            else if (current_key == "end" && (keep_text || !p->has_end_key)) p->end = val;
+        }
+        return true;
+    }
+
+    bool binary(binary_t&) override { return true; }
+
+    bool start_object(size_t) override {
+        stack.push_back({current_key, false});
+        size_t depth = stack.size();
+        if (depth == 3 && stack[1].is_array) {
+            const std::string& section = stack[1].key;
+            if (section == "transactions") {
+                arena.txns.push_back({0, 0, 0, 0, (int)arena.txns.size(), 0});
+                txn_has_date = txn_has_amount = false;
+            }
+            else if (section == "deltas") in.deltas.emplace_back();
+            else if (section == "q_periods") in.q_periods.emplace_back();
+            else if (section == "p_periods") in.p_periods.emplace_back();
+            else if (section == "k_periods") in.k_periods.emplace_back();
+        } else if (depth == 2) {
+            if (current_key == "tax") in.has_tax = true;
+            else if (current_key == "merge") in.has_merge = true;
+        } else if (depth == 4 && stack[1].key == "tax" && stack[2].key == "slabs") {
+            in.tax_slabs.push_back({0.0, 0.0});
+        }
+        return true;
+    }
+
+    bool end_object() override {
+        if (stack.size() == 3 && stack[1].is_array) {
+            const std::string& section = stack[1].key;
+            if (section == "transactions") {
+                if (!finish_transaction()) return false;
+            } else if (section == "deltas") {
+                if (!finish_delta()) return false;
+            } else if (RawPeriod* p = current_period()) {
+                if (!p->has_start_key) p->start_key = parse_date(p->start);
+                if (!p->has_end_key) p->end_key = parse_date(p->end);
+            }
+        }
+        stack.pop_back();
+        return true;
+    }
+
+    bool start_array(size_t) override {
+        stack.push_back({current_key, true});
+        return true;
+    }
+
+    bool end_array() override {
+        stack.pop_back();
+        return true;
+    }
+
+    bool key(string_t& val) override {
+        current_key = val;
+        return true;
+    }
+
+    bool parse_error(size_t, const std::string&, const nlohmann::detail::exception& ex) override {
+        error = ex.what();
+        return false;
+    }
+
+private:
+    struct Frame {
+        std::string key;
+        bool is_array;
+    };
+
+    EngineInput& in;
+    EngineArena& arena;
+    vector<Frame> stack;
+    std::string current_key;
+    double txn_amount = 0;
+    bool txn_has_date = false, txn_has_amount = false;
+
+    RawPeriod* current_period() {
+        const std::string& section = stack[1].key;
+        if (section == "q_periods") return &in.q_periods.back();
+        if (section == "p_periods") return &in.p_periods.back();
+        if (section == "k_periods") return &in.k_periods.back();
+        return nullptr;
+    }
+
+    bool finish_transaction() {
+        Transaction& t = arena.txns.back();
+        if (!txn_has_date || !txn_has_amount) {
+            error = "transactions[" + to_string(t.original_id) + "] is missing '" + (txn_has_date ? "amount" : "date") + "'";
+            return false;
+        }
+        t.amount = (long long)txn_amount;
+        t.ceiling = (long long)(ceil(txn_amount / 100.0) * 100);
+        t.amount_paise = llround(txn_amount * 100.0);
+        arena.events.push_back({t.time, 3, t.original_id, 0, 0});
+        return true;
+    }
+
+    bool finish_delta() {
+        const RawDelta& d = in.deltas.back();
+        const char* missing = !d.has_op ? "op" : !d.has_date ? "date"
+                            : (d.op != DeltaOp::Delete && !d.has_amount) ? "amount" : nullptr;
+        if (missing) {
+            error = "deltas[" + to_string(in.deltas.size() - 1) + "] is missing '" + missing + "'";
+            return false;
+        }
+        return true;
+    }
+
+    bool number(double d, long long i) {
+        size_t depth = stack.size();
+        if (depth == 1) {
+            if (current_key == "age") { in.age = (int)i; in.has_age = true; }
+            else if (current_key == "wage") { in.wage = d; in.has_wage = true; }
+            else if (current_key == "inflation") { in.inflation = d; in.has_inflation = true; }
+            return true;
+        }
+
+        const std::string& section = stack[1].key;
+        if (depth == 3 && stack[1].is_array) {
+            if (section == "transactions") {
+                if (current_key == "amount") { txn_amount = d; txn_has_amount = true; }
+            } else if (section == "deltas") {
+                if (current_key == "amount") { in.deltas.back().amount = d; in.deltas.back().has_amount = true; }
+            } else if (RawPeriod* p = current_period()) {
+                if (current_key == "start_key") { p->start_key = i; p->has_start_key = true; }
+                else if (current_key == "end_key") { p->end_key = i; p->has_end_key = true; }
+                else if ((current_key == "fixed" && section == "q_periods") || (current_key == "extra" && section == "p_periods")) {
+                    p->value = i;
+                    p->has_value = true;
+                }
+            }
+        } else if (depth == 3 && section == "merge" && stack[2].key == "kInvested") {
+            in.merge_k_invested.push_back(i);
+        } else if (depth == 2 && section == "merge") {
+            if (current_key == "totalTransactionPaise") in.merge_amount_paise = i;
+            else if (current_key == "totalCeiling") in.merge_ceiling = i;
+        } else if (depth == 3 && section == "tax" && stack[2].key == "deduction") {
+            if (current_key == "rate") { in.deduction_rate = d; in.has_deduction_rate = true; }
+            else if (current_key == "cap") { in.deduction_cap = d; in.has_deduction_cap = true; }
+        } else if (depth == 4 && section == "tax" && stack[2].key == "slabs") {
+            if (current_key == "from") in.tax_slabs.back().first = d;
+            else if (current_key == "rate") in.tax_slabs.back().second = d;
+        }
+        return true;
+    }
+};
+
+// Phase timings relative to engine start, written to stderr when the request
+// asks for a profile (stdout stays reserved for the result).
+struct PhaseTimer {
+    using clock = chrono::high_resolution_clock;
+    clock::time_point origin, last;
+    vector<pair<const char*, pair<long long, long long>>> phases;
+
+    explicit PhaseTimer(clock::time_point start) : origin(start), last(start) {}
+
+    void mark(const char* name) {
+        auto now = clock::now();
+        long long start_us = chrono::duration_cast<chrono::microseconds>(last - origin).count();
+        long long dur_us = chrono::duration_cast<chrono::microseconds>(now - last).count();
+        phases.push_back({name, {start_us, dur_us}});
+        last = now;
+    }
+
+    json to_json() const {
+        json out = json::array();
+        for (const auto& p : phases) {
+            out.push_back({{"name", p.first}, {"startUs", p.second.first}, {"durUs", p.second.second}});
+        }
+        return out;
+    }
+};
+
+long long peak_rss_kb() {
+#ifdef _WIN32
+    PROCESS_MEMORY_COUNTERS pmc;
+    if (GetProcessMemoryInfo(GetCurrentProcess(), &pmc, sizeof(pmc))) return (long long)(pmc.PeakWorkingSetSize / 1024);
+    return 0;
+#else
+    struct rusage usage;
+    if (getrusage(RUSAGE_SELF, &usage) != 0) return 0;
+#ifdef __APPLE__
+    return usage.ru_maxrss / 1024;
+#else
+    return usage.ru_maxrss;
+#endif
+#endif
 }
 
-pair<double, double> calculate_nps_metrics(long long invested, double yearly_wage, int age, double inflation) {
-    double max_deduction = min({(double)invested, yearly_wage * 0.10, 200000.0});
-    
-    double tax_without = calculate_tax(yearly_wage);
-    double tax_with = calculate_tax(yearly_wage - max_deduction);
-    double rebate = tax_without - tax_with;
+// ---------------------------------------------------------
+// Streaming output (same layout as nlohmann's dump(4))
+// ---------------------------------------------------------
 
-    int t = (age < 60) ? (60 - age) : 5;
-    double r = 0.0711; 
-    double A = invested * pow(1 + r, t);
-    double real_val = A / pow(1 + inflation, t);
-    
-    return {real_val, rebate}; 
+void append_integer(string& out, long long v) {
+    char buf[24];
+    auto res = to_chars(buf, buf + sizeof(buf), v);
+    out.append(buf, res.ptr);
 }
 
-double calculate_index_metrics(long long invested, int age, double inflation) {
+void append_double(string& out, double v) {
+    if (!isfinite(v)) {
+        out += "null";
+        return;
+    }
+    double a = fabs(v);
+    if (a != 0.0 && (a < 1e-4 || a >= 1e15)) {
+        // nlohmann switches to exponent notation here; defer to it for the rare case.
+        out += json(v).dump();
+        return;
+    }
+    char buf[64];
+    auto res = to_chars(buf, buf + sizeof(buf), v, chars_format::fixed);
+    out.append(buf, res.ptr);
+    if (find(buf, res.ptr, '.') == res.ptr) out += ".0";
+}
+
+void append_string(string& out, const string& s) {
+    static const char* hex = "0123456789abcdef";
+    out += '"';
+    for (unsigned char c : s) {
+        switch (c) {
+            case '"': out += "\\\""; break;
+            case '\\': out += "\\\\"; break;
+            case '\b': out += "\\b"; break;
+            case '\f': out += "\\f"; break;
+            case '\n': out += "\\n"; break;
+            case '\r': out += "\\r"; break;
+            case '\t': out += "\\t"; break;
+            default:
+                if (c < 0x20) {
+                    out += "\\u00";
+                    out += hex[c >> 4];
+                    out += hex[c & 0xF];
+                } else {
+                    out += (char)c;
+                }
+        }
+    }
+    out += '"';
+}
+
+// Rupees rounded to one decimal, half away from zero like std::round.
+double round_paise_to_tenths(long long paise) {
+    long long tenths = (paise >= 0 ? paise + 5 : paise - 5) / 10;
+    return tenths / 10.0;
+}
+
+// ---------------------------------------------------------
+// Tax and projections
+// ---------------------------------------------------------
+
+// Slab table compiled into cumulative form: base_tax[i] is the tax owed at
+// exactly lower[i], so any income costs one binary search plus one multiply.
+struct TaxTable {
+    vector<double> lower;
+    vector<double> rate;
+    vector<double> base_tax;
+    double deduction_rate = 0;
+    double deduction_cap = 0;
+
+    void add_slab(double from, double r) {
+        if (!lower.empty()) {
+            base_tax.push_back(base_tax.back() + (from - lower.back()) * rate.back());
+        } else {
+            base_tax.push_back(0.0);
+        }
+        lower.push_back(from);
+        rate.push_back(r);
+    }
+
+    double tax(double income) const {
+        auto it = upper_bound(lower.begin(), lower.end(), income);
+        if (it == lower.begin()) return 0.0;
+        size_t i = distance(lower.begin(), it) - 1;
+        return base_tax[i] + (income - lower[i]) * rate[i];
+    }
+
+    double max_deduction(long long invested, double yearly_wage) const {
+        return min({(double)invested, yearly_wage * deduction_rate, deduction_cap});
+    }
+
+    // Rebate for every deduction amount against the same income; the
+    // no-deduction tax is computed once for the whole batch.
+    void rebates(double income, const vector<double>& deductions, vector<double>& out) const {
+        double tax_without = tax(income);
+        out.resize(deductions.size());
+        for (size_t i = 0; i < deductions.size(); ++i) {
+            out[i] = tax_without - tax(income - deductions[i]);
+        }
+    }
+};
+
+TaxTable load_tax_table(EngineInput& input) {
+    TaxTable table;
+    sort(input.tax_slabs.begin(), input.tax_slabs.end());
+    for (const auto& s : input.tax_slabs) table.add_slab(s.first, s.second);
+
+    table.deduction_rate = input.deduction_rate;
+    table.deduction_cap = input.deduction_cap;
+    return table;
+}
+
+double project_real_value(long long invested, double r, int age, double inflation) {
     int t = (age < 60) ? (60 - age) : 5;
-    double r = 0.1449; 
     double A = invested * pow(1 + r, t);
     return A / pow(1 + inflation, t);
 }
 
-int main() {
-    auto start_perf = chrono::high_resolution_clock::now();
-    ios_base::sync_with_stdio(false);
-    cin.tie(NULL);
+double calculate_nps_metrics(long long invested, int age, double inflation) {
+    return project_real_value(invested, 0.0711, age, inflation);
+}
 
-    json input_data;
-    if (!(cin >> input_data)) return 0;
+double calculate_index_metrics(long long invested, int age, double inflation) {
+    return project_real_value(invested, 0.1449, age, inflation);
+}
 
-    string mode = input_data.value("mode", "nps");
-    int age = input_data["age"];
-    double monthly_wage = input_data["wage"];
-    
-    double inflation = (double)input_data["inflation"] / 100.0;
-    
-    double yearly_wage = monthly_wage * 12.0;
+// ---------------------------------------------------------
+// Session mode
+// ---------------------------------------------------------
+
+// The sweep's Q/P rules evaluated at a single timestamp, so a session delta
+// never re-sweeps the base set. A Q period applies from its start through its
+// end; an inverted one (end before start) never ends, since its end event
+// fires first and is ignored. The latest start wins, ties to the lower index.
+// The P sum at t is every extra started by t minus every extra ended before t.
+struct PeriodRules {
+    vector<long long> q_start, q_end, q_fixed;
+    vector<long long> p_start, p_end;
+    vector<long long> p_start_sum, p_end_sum;
+
+    void build(const vector<RawPeriod>& q, const vector<RawPeriod>& p) {
+        for (const auto& period : q) {
+            q_start.push_back(period.start_key);
+            q_end.push_back(period.end_key);
+            q_fixed.push_back(period.value);
+        }
+        vector<pair<long long, long long>> starts, ends;
+        for (const auto& period : p) {
+            starts.push_back({period.start_key, period.value});
+            ends.push_back({period.end_key, period.value});
+        }
+        sorted_sums(starts, p_start, p_start_sum);
+        sorted_sums(ends, p_end, p_end_sum);
+    }
 
-    vector<Transaction> txns; 
-    vector<Event> events;
+    long long remanent(long long time, long long amount) const {
+        long long result = (amount % 100 == 0) ? 0 : 100 - (amount % 100);
+        int best = -1;
+        for (size_t i = 0; i < q_start.size(); ++i) {
+            bool active = q_start[i] <= time && (q_end[i] >= time || q_end[i] < q_start[i]);
+            if (active && (best < 0 || q_start[i] > q_start[best])) best = (int)i;
+        }
+        if (best >= 0) result = q_fixed[best];
+
+        size_t started = distance(p_start.begin(), upper_bound(p_start.begin(), p_start.end(), time));
+        size_t ended = distance(p_end.begin(), lower_bound(p_end.begin(), p_end.end(), time));
+        return result + p_start_sum[started] - p_end_sum[ended];
+    }
+
+private:
+    static void sorted_sums(vector<pair<long long, long long>>& items, vector<long long>& keys, vector<long long>& sums) {
+        sort(items.begin(), items.end());
+        sums.assign(1, 0);
+        for (const auto& item : items) {
+            keys.push_back(item.first);
+            sums.push_back(sums.back() + item.second);
+        }
+    }
+};
 
-    double global_total_amount = 0;
-    double global_total_ceiling = 0;
+// True once only whitespace is left on stdin.
+bool input_exhausted() {
+    cin >> ws;
+    return cin.peek() == char_traits<char>::eof();
+}
+
+// Session responses are framed as "<byte length>\n<body>" so the caller can
+// read exactly one result without waiting for the pipe to close.
+void write_frame(const string& body) {
+    string header = to_string(body.size()) + "\n";
+    cout.write(header.data(), header.size());
+    cout.write(body.data(), body.size());
+    cout.flush();
+}
 
-    int txn_idx = 0;
-    for (const auto& item : input_data["transactions"]) {
-        long long t_time = parse_date(item["date"]);
-        double amt = item["amount"];
-        
-        long long ceiling = (long long)(ceil(amt / 100.0) * 100);
-        
-        global_total_amount += amt;
-        global_total_ceiling += ceiling;
+int main() {
+    auto start_perf = chrono::high_resolution_clock::now();
+    PhaseTimer timer(start_perf);
+    ios_base::sync_with_stdio(false);
+    cin.tie(NULL);
 
-        txns.push_back({t_time, (long long)amt, ceiling, 0, txn_idx});
-        events.push_back({t_time, 3, txn_idx, 0, 0});
-        txn_idx++;
+    EngineInput input;
+    EngineArena arena;
+    InputReader reader(input, arena);
+    // Non-strict, so a session can keep stdin open after its first document.
+    if (!json::sax_parse(cin, &reader, json::input_format_t::json, false)) {
+        cerr << "Invalid engine input: " << reader.error << endl;
+        return 1;
+    }
+    if (!input.session && !input_exhausted()) {
+        cerr << "Invalid engine input: unexpected data after the payload" << endl;
+        return 1;
+    }
+    const pair<bool, const char*> required[] = {
+        {input.has_mode, "mode"}, {input.has_age, "age"}, {input.has_wage, "wage"}, {input.has_inflation, "inflation"},
+        {input.has_tax, "tax"}, {!input.tax_slabs.empty(), "tax.slabs"},
+        {input.has_deduction_rate, "tax.deduction.rate"}, {input.has_deduction_cap, "tax.deduction.cap"}
+    };
+    for (const auto& field : required) {
+        if (!field.first) { cerr << "Engine input is missing '" << field.second << "'" << endl; return 1; }
+    }
+    for (size_t i = 0; i < input.q_periods.size(); ++i) {
+        if (!input.q_periods[i].has_value) { cerr << "q_periods[" << i << "] is missing 'fixed'" << endl; return 1; }
+    }
+    for (size_t i = 0; i < input.p_periods.size(); ++i) {
+        if (!input.p_periods[i].has_value) { cerr << "p_periods[" << i << "] is missing 'extra'" << endl; return 1; }
     }
 
+    const string& mode = input.mode;
+    int age = input.age;
+    double inflation = input.inflation / 100.0;
+    double yearly_wage = input.wage * 12.0;
+    TaxTable tax_table = load_tax_table(input);
+
+    arena.reserve(input.q_periods.size(), input.p_periods.size(), input.k_periods.size());
+    auto& txns = arena.txns;
+    auto& events = arena.events;
+
+    // Totals are kept in exact integer paise so that any split of the set
+    // (shards, session deltas) adds up to the same figure as a single pass.
+    long long global_total_paise = 0;
+    long long global_total_ceiling = 0;
+    for (const auto& t : txns) {
+        global_total_paise += t.amount_paise;
+        global_total_ceiling += t.ceiling;
+    }
+    int n_txns = txns.size();
+
     int q_idx = 0;
-    for (const auto& q : input_data["q_periods"]) {
-        events.push_back({parse_date(q["start"]), 2, q_idx, 0, parse_date(q["start"])});
-        events.push_back({parse_date(q["end"]), 4, q_idx, 0, parse_date(q["start"])});
-        q_fixed_amounts.push_back(q["fixed"]);
+    for (const auto& q : input.q_periods) {
+        events.push_back({q.start_key, 2, q_idx, 0, q.start_key});
+        events.push_back({q.end_key, 4, q_idx, 0, q.start_key});
+        arena.q_fixed_amounts.push_back(q.value);
         q_idx++;
     }
 
     int p_idx = 0;
-    for (const auto& p : input_data["p_periods"]) {
-        events.push_back({parse_date(p["start"]), 1, p_idx, (long long)p["extra"], 0});
-        events.push_back({parse_date(p["end"]), 5, p_idx, (long long)p["extra"], 0});
+    for (const auto& p : input.p_periods) {
+        events.push_back({p.start_key, 1, p_idx, p.value, 0});
+        events.push_back({p.end_key, 5, p_idx, p.value, 0});
         p_idx++;
     }
 
-    sort(events.begin(), events.end());
+    timer.mark("parse");
+    // Transaction events come first in input order; when presorted, only the
+    // Q/P events need sorting before a linear merge.
+    if (input.presorted) {
+        auto txn_end = events.begin() + n_txns;
+        sort(txn_end, events.end());
+        inplace_merge(events.begin(), txn_end, events.end());
+    } else {
+        sort(events.begin(), events.end());
+    }
+    timer.mark("sort");
     long long current_p_sum = 0;
-    set<pair<long long, int>> active_q; 
+    auto& active_q = arena.active_q;
+    auto& q_state = arena.q_state;
+    auto heap_order = greater<pair<long long, int>>();
 
     for (const auto& ev : events) {
         if (ev.type == 1) current_p_sum += ev.val;
-        else if (ev.type == 2) active_q.insert({-ev.q_start, ev.id});
-        else if (ev.type == 4) active_q.erase({-ev.q_start, ev.id});
+        else if (ev.type == 2) {
+            q_state[ev.id] = 1;
+            active_q.push_back({-ev.q_start, ev.id});
+            push_heap(active_q.begin(), active_q.end(), heap_order);
+        }
+        else if (ev.type == 4) {
+            // Ending a period that never started is a no-op, as with set::erase.
+            if (q_state[ev.id] == 1) q_state[ev.id] = 2;
+        }
         else if (ev.type == 5) current_p_sum -= ev.val;
-        else if (ev.type == 3) { 
+        else if (ev.type == 3) {
             long long amt = txns[ev.id].amount;
             long long remanent = (amt % 100 == 0) ? 0 : 100 - (amt % 100);
 
+            while (!active_q.empty() && q_state[active_q.front().second] == 2) {
+                pop_heap(active_q.begin(), active_q.end(), heap_order);
+                active_q.pop_back();
+            }
             if (!active_q.empty()) {
-                remanent = q_fixed_amounts[active_q.begin()->second];
+                remanent = arena.q_fixed_amounts[active_q.front().second];
             }
-            remanent += current_p_sum;
-            txns[ev.id].final_remanent = remanent;
-        } 
+            txns[ev.id].final_remanent = remanent + current_p_sum;
+        }
     }
 
-    sort(txns.begin(), txns.end(), [](const Transaction& a, const Transaction& b) {
-        return a.time < b.time;
-    });
-
-    vector<long long> txn_times(txns.size());
-    vector<long long> pref_sums(txns.size() + 1, 0);
+    timer.mark("sweep");
 
-    for (size_t i = 0; i < txns.size(); ++i) {
-        txn_times[i] = txns[i].time;
-        pref_sums[i + 1] = pref_sums[i] + txns[i].final_remanent;
+    if (!input.presorted) {
+        sort(txns.begin(), txns.end(), [](const Transaction& a, const Transaction& b) {
+            return a.time < b.time;
+        });
     }
 
+    SavingsIndex& index = arena.index;
+    for (const auto& t : txns) {
+        if (index.times.empty() || index.times.back() != t.time) {
+            index.times.push_back(t.time);
+            index.remanent.push_back(0);
+            index.amount_paise.push_back(0);
+            index.ceiling.push_back(0);
+        }
+        index.remanent.back() += t.final_remanent;
+        index.amount_paise.back() += t.amount_paise;
+        index.ceiling.back() += t.ceiling;
+    }
+    index.tree.build(index.remanent);
 
+    timer.mark("index");
     auto end_perf = chrono::high_resolution_clock::now();
     auto duration = chrono::duration_cast<chrono::microseconds>(end_perf - start_perf);
 
-    json response;
-    response["totalTransactionAmount"] = round(global_total_amount * 10.0) / 10.0;
-    response["totalCeiling"] = round(global_total_ceiling * 10.0) / 10.0;
-    response["savingsByDates"] = json::array();
+    const auto& k_periods = input.k_periods;
+    auto& k_invested = arena.k_invested;
+    auto query_windows = [&]() {
+        k_invested.clear();
+        for (const auto& k : k_periods) k_invested.push_back(index.window(k.start_key, k.end_key));
+    };
+    query_windows();
+    timer.mark("k_queries");
+
+    string& out = arena.out;
+
+    // Distributed mode: a shard returns raw sums only; the API adds them up
+    // and sends them back as "merge" so the projections run exactly once.
+    if (input.partial) {
+        out += "{\"totalTransactionPaise\":";
+        append_integer(out, global_total_paise);
+        out += ",\"totalCeiling\":";
+        append_integer(out, global_total_ceiling);
+        out += ",\"kInvested\":[";
+        for (size_t i = 0; i < k_invested.size(); ++i) {
+            if (i) out += ',';
+            append_integer(out, k_invested[i]);
+        }
+        out += "]}\n";
+        cout.write(out.data(), out.size());
+        cout.flush();
+        return 0;
+    }
 
-    for (const auto& k : input_data["k_periods"]) {
-        long long k_start = parse_date(k["start"]);
-        long long k_end = parse_date(k["end"]);
+    if (input.has_merge) {
+        global_total_paise = input.merge_amount_paise;
+        global_total_ceiling = input.merge_ceiling;
+        k_invested.assign(input.merge_k_invested.begin(), input.merge_k_invested.end());
+    }
 
-        auto it_start = lower_bound(txn_times.begin(), txn_times.end(), k_start);
-        auto it_end = upper_bound(txn_times.begin(), txn_times.end(), k_end);
+    auto& k_deductions = arena.k_deductions;
+    auto& k_rebates = arena.k_rebates;
+    auto render_result = [&](long long execution_us, const char* complexity) {
+        out.clear();
+        k_deductions.clear();
+        for (long long invested : k_invested) {
+            k_deductions.push_back(tax_table.max_deduction(invested, yearly_wage));
+        }
+        if (mode == "nps") tax_table.rebates(yearly_wage, k_deductions, k_rebates);
+
+        out += "{\n    \"totalTransactionAmount\": ";
+        append_double(out, round_paise_to_tenths(global_total_paise));
+        out += ",\n    \"totalCeiling\": ";
+        append_double(out, (double)global_total_ceiling);
+        out += k_periods.empty() ? ",\n    \"savingsByDates\": []" : ",\n    \"savingsByDates\": [";
+
+        for (size_t i = 0; i < k_periods.size(); ++i) {
+            const auto& k = k_periods[i];
+            long long invested = k_invested[i];
+            double profit = 0, tax_benefit = 0;
+
+            if (mode == "nps") {
+                profit = calculate_nps_metrics(invested, age, inflation) - invested;
+                tax_benefit = k_rebates[i];
+            } else {
+                profit = calculate_index_metrics(invested, age, inflation) - invested;
+            }
 
-        long long invested = 0;
-        if (it_start < it_end) {
-            invested = pref_sums[distance(txn_times.begin(), it_end)] - pref_sums[distance(txn_times.begin(), it_start)];
+            out += (i == 0) ? "\n        {\n            \"start\": " : ",\n        {\n            \"start\": ";
+            append_string(out, k.start);
+            out += ",\n            \"end\": ";
+            append_string(out, k.end);
+            out += ",\n            \"amount\": ";
+            append_double(out, round(invested * 10.0) / 10.0);
+            out += ",\n            \"profit\": ";
+            append_double(out, round(profit * 100.0) / 100.0);
+            out += ",\n            \"taxBenefit\": ";
+            append_double(out, round(tax_benefit * 10.0) / 10.0);
+            out += "\n        }";
         }
+        if (!k_periods.empty()) out += "\n    ]";
+
+        out += ",\n    \"performance\": {\n        \"executionTimeUs\": ";
+        append_integer(out, execution_us);
+        out += ",\n        \"complexity\": \"";
+        out += complexity;
+        out += "\",\n        \"engine\": \"C++20 Optimized\",\n        \"peakRssKb\": ";
+        append_integer(out, peak_rss_kb());
+        out += "\n    }\n}\n";
+    };
 
-        double profit = 0, tax_benefit = 0;
+    // Rebates, projections and response formatting.
+    render_result(duration.count(), "O(N log N)");
+    timer.mark("render");
 
-        if (mode == "nps") {
-            pair<double, double> res = calculate_nps_metrics(invested, yearly_wage, age, inflation);
-            profit = res.first - invested;
-            tax_benefit = res.second;
-        } else {
-            profit = calculate_index_metrics(invested, age, inflation) - invested;
-        }
-
-        json k_res;
-        k_res["start"] = k["start"];
-        k_res["end"] = k["end"];
-        k_res["amount"] = round(invested * 10.0) / 10.0;
-        k_res["profit"] = round(profit * 100.0) / 100.0;
-        k_res["taxBenefit"] = round(tax_benefit * 10.0) / 10.0;
-        
-        response["savingsByDates"].push_back(k_res);
-    }
-    response["performance"] = {
-        {"executionTimeUs", duration.count()},
-        {"complexity", "O(N log N)"},
-        {"engine", "C++20 Optimized"}
-    };
+    if (!input.session) {
+        cout.write(out.data(), out.size());
+        cout.flush();
+        timer.mark("dump");
+
+        if (input.profile) {
+            json trace;
+            trace["phases"] = timer.to_json();
+            trace["peakRssKb"] = peak_rss_kb();
+            cerr << trace.dump() << endl;
+        }
+        return 0;
+    }
+
+    // Session mode: keep the index and answer every following {"deltas": [...]}
+    // document with the full result. A delta costs O(Q + log P + log N) against
+    // the kept state and the K windows are re-queried; the base set is never
+    // swept again. Deltas are validated by the API, which owns the session.
+    PeriodRules rules;
+    rules.build(input.q_periods, input.p_periods);
+    write_frame(out);
+
+    while (!input_exhausted()) {
+        auto batch_start = chrono::high_resolution_clock::now();
+        EngineInput batch;
+        InputReader batch_reader(batch, arena);
+        if (!json::sax_parse(cin, &batch_reader, json::input_format_t::json, false)) {
+            cerr << "Invalid delta batch: " << batch_reader.error << endl;
+            return 1;
+        }
 
-    cout << response.dump(4) << endl;
+        for (const auto& d : batch.deltas) {
+            Bucket before = index.get(d.time);
+            Bucket after;
+            if (d.op != DeltaOp::Delete) {
+                after.remanent = rules.remanent(d.time, (long long)d.amount);
+                after.amount_paise = llround(d.amount * 100.0);
+                after.ceiling = (long long)(ceil(d.amount / 100.0) * 100);
+                if (d.op == DeltaOp::Insert) {
+                    after.remanent += before.remanent;
+                    after.amount_paise += before.amount_paise;
+                    after.ceiling += before.ceiling;
+                }
+            }
+            index.set(d.time, after);
+            global_total_paise += after.amount_paise - before.amount_paise;
+            global_total_ceiling += after.ceiling - before.ceiling;
+        }
+        query_windows();
+
+        auto batch_us = chrono::duration_cast<chrono::microseconds>(chrono::high_resolution_clock::now() - batch_start);
+        render_result(batch_us.count(), "O(D (Q + log N) + K log N)");
+        write_frame(out);
+    }
     return 0;
-}
\ No newline at end of file
+}
@@ -0,0 +1,139 @@
+import os
+import time
+import pytest
+from fastapi.testclient import TestClient
+import api.main as main
+
+ENGINE = os.environ.get("ENGINE_PATH", main.ENGINE_PATH)
+RETURNS_URL = "/blackrock/challenge/v1/returns:nps"
+
+needs_engine = pytest.mark.skipif(not os.access(ENGINE, os.X_OK), reason="needs a built engine (set ENGINE_PATH)")
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, "ENGINE_PATH", ENGINE)
+    return TestClient(main.app)
+
+
+def build_request(transactions, session=False):
+    return {
+        "age": 30, "wage": 50000, "inflation": 5.5,
+        "q": [{"start": "2023-03-01 00:00:00", "end": "2023-04-30 23:59:59", "fixed": 40}],
+        "p": [{"start": "2023-02-01 00:00:00", "end": "2023-05-31 23:59:59", "extra": 15}],
+        "k": [{"start": "2023-01-01 00:00:00", "end": "2023-12-31 23:59:59"},
+              {"start": "2023-02-15 00:00:00", "end": "2023-04-15 00:00:00"}],
+        "transactions": [{"date": d, "amount": a} for d, a in sorted(transactions.items())],
+        "session": session,
+    }
+
+
+def without_performance(result):
+    result.pop("performance")
+    return result
+
+
+BASE = {f"2023-{m:02d}-10 10:00:00": a for m, a in enumerate([4785.62, 29.54, 3918.49, 4102.61, 4431.01, 3702.78], 1)}
+
+
+# ✅ 1. Insert/update/delete on a session give the same result as a fresh run of the corrected set
+@needs_engine
+def test_session_deltas_match_fresh_run(client):
+    opened = client.post(RETURNS_URL, json=build_request(BASE, session=True))
+    assert opened.status_code == 200
+    deltas_url = f"/blackrock/challenge/v1/sessions/{opened.headers['X-Session-Id']}/deltas"
+
+    steps = [
+        # New timestamps inside the Q window, the P window and outside both
+        [{"op": "insert", "date": "2023-03-20 09:00:00", "amount": 120.5},
+         {"op": "insert", "date": "2023-05-02 09:00:00", "amount": 75},
+         {"op": "insert", "date": "2023-11-11 11:11:11", "amount": 1999.99}],
+        [{"op": "update", "date": "2023-04-10 10:00:00", "amount": 10},
+         {"op": "delete", "date": "2023-02-10 10:00:00"}],
+        [{"op": "delete", "date": "2023-03-20 09:00:00"},
+         {"op": "update", "date": "2023-11-11 11:11:11", "amount": 2000},
+         {"op": "insert", "date": "2023-02-10 10:00:00", "amount": 30}],
+    ]
+
+    expected = dict(BASE)
+    for deltas in steps:
+        for d in deltas:
+            if d["op"] == "delete":
+                del expected[d["date"]]
+            else:
+                expected[d["date"]] = d["amount"]
+
+        response = client.post(deltas_url, json={"deltas": deltas})
+        assert response.status_code == 200
+        result = response.json()
+        assert result.pop("invalid_deltas") == []
+
+        fresh = client.post(RETURNS_URL, json=build_request(expected)).json()
+        assert without_performance(result) == without_performance(fresh)
+        assert result["totalTransactionAmount"] == round(sum(expected.values()), 1)
+
+    assert client.delete(deltas_url.rsplit("/", 1)[0]).status_code == 200
+
+
+# ✅ 2. Rejected deltas are reported and never reach the engine's state
+@needs_engine
+def test_session_reports_invalid_deltas(client):
+    opened = client.post(RETURNS_URL, json=build_request(BASE, session=True))
+    deltas_url = f"/blackrock/challenge/v1/sessions/{opened.headers['X-Session-Id']}/deltas"
+
+    response = client.post(deltas_url, json={"deltas": [
+        {"op": "insert", "date": "2023-01-10 10:00:00", "amount": 50},
+        {"op": "delete", "date": "2023-07-10 10:00:00"},
+        {"op": "insert", "date": "2023-13-01 00:00:00", "amount": 50},
+    ]})
+    result = response.json()
+    assert [d["delta"]["op"] for d in result.pop("invalid_deltas")] == ["insert", "delete", "insert"]
+    assert without_performance(result) == without_performance(opened.json())
+
+    client.delete(deltas_url.rsplit("/", 1)[0])
+
+
+# ✅ 3. The least recently used session is closed once the store is full
+@needs_engine
+def test_session_store_evicts_oldest(client, monkeypatch):
+    monkeypatch.setattr(main, "SESSION_STORE_SIZE", 1)
+    first = client.post(RETURNS_URL, json=build_request(BASE, session=True)).headers["X-Session-Id"]
+    process = main.engine_sessions[first].process
+    second = client.post(RETURNS_URL, json=build_request(BASE, session=True)).headers["X-Session-Id"]
+
+    assert process.poll() == 0
+    assert client.post(f"/blackrock/challenge/v1/sessions/{first}/deltas", json={"deltas": []}).status_code == 404
+    assert client.delete(f"/blackrock/challenge/v1/sessions/{second}").status_code == 200
+
+
+# ✅ 4. Idle sessions are reaped in the background, without new requests
+@needs_engine
+def test_idle_sessions_reaped(monkeypatch):
+    monkeypatch.setattr(main, "ENGINE_PATH", ENGINE)
+    monkeypatch.setattr(main, "SESSION_IDLE_SECONDS", 0.2)
+    with TestClient(main.app) as client:
+        session_id = client.post(RETURNS_URL, json=build_request(BASE, session=True)).headers["X-Session-Id"]
+        process = main.engine_sessions[session_id].process
+        deadline = time.monotonic() + 5
+        while session_id in main.engine_sessions and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        assert session_id not in main.engine_sessions
+        assert process.wait(timeout=5) == 0
+
+
+# ✅ 5. A session engine that stops answering is killed instead of blocking the server
+def test_hung_session_engine_killed(tmp_path, monkeypatch):
+    hung = tmp_path / "hung_engine"
+    hung.write_text("#!/bin/sh\nexec sleep 60\n")
+    hung.chmod(0o755)
+    monkeypatch.setattr(main, "ENGINE_PATH", str(hung))
+    monkeypatch.setattr(main, "SESSION_TIMEOUT_SECONDS", 0.5)
+    client = TestClient(main.app)
+
+    started = time.monotonic()
+    response = client.post(RETURNS_URL, json=build_request(BASE, session=True))
+    assert response.status_code == 500
+    assert "did not respond" in response.json()["detail"]
+    assert time.monotonic() - started < 5
+    assert "X-Session-Id" not in response.headers
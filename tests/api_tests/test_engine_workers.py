@@ -0,0 +1,140 @@
+import asyncio
+import os
+import shutil
+import threading
+import pytest
+from fastapi.testclient import TestClient
+import api.main as main
+from api.main import shard_engine_payload
+from api.worker import call_worker, handle_connection, read_frame, WorkerError
+
+
+def period(start_key, end_key, **extra):
+    return {"start": "", "end": "", "start_key": start_key, "end_key": end_key, **extra}
+
+
+def build_payload():
+    return {
+        "mode": "nps",
+        "k_periods": [period(20230101000000, 20231231235959)],
+        "q_periods": [
+            period(20230101000000, 20230131235959, fixed=0),   # only January
+            period(20231201000000, 20231101000000, fixed=5),   # inverted, live from Dec 1
+        ],
+        "p_periods": [period(20230601000000, 20230630235959, extra=25)],
+        "transactions": [
+            {"date": "2023-12-15 10:00:00", "amount": 100},
+            {"date": "2023-01-10 10:00:00", "amount": 100},
+            {"date": "2023-06-10 10:00:00", "amount": 100},
+            {"date": "2023-03-10 10:00:00", "amount": 100},
+        ]
+    }
+
+
+# ✅ 1. Shards are time-contiguous and carry only the live Q/P periods
+def test_shards_seeded_with_overlapping_periods():
+    shards = shard_engine_payload(build_payload(), 2)
+
+    assert [[t["date"][:7] for t in s["transactions"]] for s in shards] == [
+        ["2023-01", "2023-03"],
+        ["2023-06", "2023-12"],
+    ]
+    assert [q["fixed"] for q in shards[0]["q_periods"]] == [0]
+    assert [q["fixed"] for q in shards[1]["q_periods"]] == [5]
+    assert shards[0]["p_periods"] == []
+    assert len(shards[1]["p_periods"]) == 1
+    assert all(s["partial"] and len(s["k_periods"]) == 1 for s in shards)
+
+
+def test_no_shards_without_transactions():
+    payload = {**build_payload(), "transactions": []}
+    assert shard_engine_payload(payload, 3) == []
+
+
+# ✅ 2. Worker protocol round trip on localhost (cat/false stand in for the engine)
+@pytest.mark.skipif(shutil.which("cat") is None or shutil.which("false") is None,
+                    reason="needs cat/false as stand-in engines")
+def test_worker_round_trip():
+    async def start_worker(engine_path):
+        server = await asyncio.start_server(
+            lambda r, w: handle_connection(r, w, engine_path), "127.0.0.1", 0
+        )
+        return server, "127.0.0.1:%d" % server.sockets[0].getsockname()[1]
+
+    async def scenario():
+        echo, echo_addr = await start_worker(shutil.which("cat"))
+        failing, failing_addr = await start_worker(shutil.which("false"))
+        missing, missing_addr = await start_worker("/nonexistent/engine")
+        async with echo, failing, missing:
+            assert await call_worker(echo_addr, b'{"ok": true}') == b'{"ok": true}'
+            with pytest.raises(WorkerError):
+                await call_worker(failing_addr, b"{}")
+            with pytest.raises(WorkerError, match="Could not start engine"):
+                await call_worker(missing_addr, b"{}")
+
+        # A worker that drops the connection surfaces as WorkerError, not IncompleteReadError
+        async def hang_up(reader, writer):
+            await read_frame(reader)
+            writer.close()
+
+        dropped = await asyncio.start_server(hang_up, "127.0.0.1", 0)
+        async with dropped:
+            with pytest.raises(WorkerError, match="without a response"):
+                await call_worker("127.0.0.1:%d" % dropped.sockets[0].getsockname()[1], b"{}")
+
+    asyncio.run(scenario())
+
+
+ENGINE = os.environ.get("ENGINE_PATH", main.ENGINE_PATH)
+
+
+@pytest.fixture
+def local_workers():
+    """Three workers running the real engine on an event loop in a background thread."""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    async def start():
+        return await asyncio.start_server(lambda r, w: handle_connection(r, w, ENGINE), "127.0.0.1", 0)
+
+    servers = [asyncio.run_coroutine_threadsafe(start(), loop).result() for _ in range(3)]
+    yield ["127.0.0.1:%d" % s.sockets[0].getsockname()[1] for s in servers]
+
+    for server in servers:
+        loop.call_soon_threadsafe(server.close)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+
+
+# ✅ 3. Sharded partial + merge gives exactly the single-engine result
+@pytest.mark.skipif(not os.access(ENGINE, os.X_OK), reason="needs a built engine (set ENGINE_PATH)")
+def test_sharded_result_matches_single_run(local_workers, monkeypatch):
+    monkeypatch.setattr(main, "ENGINE_PATH", ENGINE)
+    monkeypatch.setattr(main, "SHARD_MIN_TRANSACTIONS", 1)
+    client = TestClient(main.app)
+
+    # In double arithmetic these sum to 20970.049999999996 one by one but to
+    # 20970.05 in pairs, which rounded to 20970.0 vs 20970.1 before totals
+    # were kept in paise.
+    amounts = [4785.62, 29.54, 3918.49, 4102.61, 4431.01, 3702.78]
+    payload = {
+        "age": 30, "wage": 50000, "inflation": 5.5,
+        "q": [{"start": "2023-03-01 00:00:00", "end": "2023-04-30 23:59:59", "fixed": 40}],
+        "p": [{"start": "2023-02-01 00:00:00", "end": "2023-05-31 23:59:59", "extra": 15}],
+        "k": [{"start": "2023-01-01 00:00:00", "end": "2023-12-31 23:59:59"},
+              {"start": "2023-02-15 00:00:00", "end": "2023-04-15 00:00:00"}],
+        "transactions": [{"date": f"2023-{m:02d}-10 10:00:00", "amount": a} for m, a in enumerate(amounts, 1)]
+    }
+
+    results = {}
+    for workers in ([], local_workers):
+        monkeypatch.setattr(main, "ENGINE_WORKERS", workers)
+        response = client.post("/blackrock/challenge/v1/returns:nps", json=payload)
+        assert response.status_code == 200
+        result = response.json()
+        result.pop("performance")
+        results[len(workers)] = result
+
+    assert results[0] == results[3]
+    assert results[0]["totalTransactionAmount"] == 20970.1
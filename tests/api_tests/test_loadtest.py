@@ -0,0 +1,58 @@
+import os
+import random
+import subprocess
+import pytest
+from fastapi.testclient import TestClient
+from api.main import app, ChallengeRequest
+from api.loadtest import API_PREFIX, ENDPOINTS, build_payload, parse_weights, percentile, proc_stats, summarize
+
+client = TestClient(app)
+
+
+# ✅ 1. Generated bodies are accepted by the endpoints they target
+def test_payloads_match_endpoint_schemas():
+    rng = random.Random(1)
+    for endpoint in ("parse", "validator", "filter"):
+        response = client.post(API_PREFIX + ENDPOINTS[endpoint], json=build_payload(endpoint, 20, rng))
+        assert response.status_code == 200, endpoint
+
+    filtered = client.post(API_PREFIX + ENDPOINTS["filter"], json=build_payload("filter", 50, rng)).json()
+    assert filtered["invalid_transactions"] == [] and filtered["transactions_sorted"] is True
+
+    for endpoint in ("nps", "index"):
+        assert len(ChallengeRequest(**build_payload(endpoint, 20, rng)).transactions) == 20
+
+
+# ✅ 2. Report math: throughput, error rate and nearest-rank percentiles
+def test_summary_percentiles_and_errors():
+    results = {
+        "nps": {"latencies": [i / 1000 for i in range(1, 101)], "errors": {"500": 5}},
+        "parse": {"latencies": [], "errors": {}},
+    }
+    report = summarize(results, elapsed=10.0)
+
+    nps = report["endpoints"]["nps"]
+    assert nps["requests"] == 100 and nps["throughputRps"] == 10.0
+    assert nps["errorRate"] == 0.05
+    assert (nps["p50Ms"], nps["p90Ms"], nps["p99Ms"], nps["maxMs"]) == (50.0, 90.0, 99.0, 100.0)
+    assert report["endpoints"]["parse"]["requests"] == 0
+    assert parse_weights("10=6,1000", int) == [(10, 6.0), (1000, 1.0)]
+
+    # Odd sample count: nearest rank is ceil(p/100 * n), never rounded down
+    assert [percentile([1, 2, 3, 4, 5], p) for p in (50, 90, 99)] == [3, 5, 5]
+    assert percentile([1, 2, 3, 4], 50) == 2
+
+
+# ✅ 3. /proc sampling sees live child processes
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="needs Linux /proc")
+def test_proc_stats_counts_children():
+    before = proc_stats(os.getpid())
+    child = subprocess.Popen(["sleep", "5"])
+    try:
+        during = proc_stats(os.getpid())
+    finally:
+        child.kill()
+        child.wait()
+
+    assert during["rssKb"] > 0 and during["fds"] > 0
+    assert during["children"] == before["children"] + 1
@@ -42,4 +42,18 @@ def test_build_transactions_invalid_amount():
     )
 
     # Pydantic validation should fail
-    assert response.status_code == 422
\ No newline at end of file
+    assert response.status_code == 422
+
+def test_build_transactions_sub_paise_amount():
+    payload = [
+        {"date": "2026-02-20", "amount": 156.645}
+    ]
+
+    response = client.post(
+        "/blackrock/challenge/v1/transactions:parse",
+        json=payload
+    )
+
+    # Amounts must be whole paise, so the engine's totals stay exact
+    assert response.status_code == 422
+    assert "whole number of paise" in response.text
@@ -1,3 +1,4 @@
+import io
 import json
 import pytest
 from fastapi.testclient import TestClient
@@ -115,4 +116,122 @@ def test_only_valid_transactions_sent(mock_popen):
 
     # Only 1 transaction should be sent (status == "valid")
     assert len(sent_payload["transactions"]) == 1
-    assert sent_payload["transactions"][0]["status"] == "valid"
\ No newline at end of file
+    assert sent_payload["transactions"][0]["status"] == "valid"
+
+# -------------------------------------------------
+# Test 5 — Session Deltas Are Checked Before The Engine
+# -------------------------------------------------
+@patch("subprocess.Popen")
+def test_session_deltas_validated(mock_popen):
+    frames = [b'{"ok": true}', b'{"totalTransactionAmount": 459.5}']
+    mock_process = MagicMock()
+    mock_process.stdout = io.BytesIO(b"".join(b"%d\n%s" % (len(f), f) for f in frames))
+    mock_process.poll.return_value = None
+    mock_popen.return_value = mock_process
+
+    payload = {
+        "age": 30,
+        "wage": 1000,
+        "inflation": 5.0,
+        "q": [], "p": [], "k": [],
+        "transactions": [{"date": "2024-01-01 10:00:00", "amount": 250}],
+        "session": True
+    }
+
+    response = client.post("/blackrock/challenge/v1/returns:nps", json=payload)
+    assert response.status_code == 200
+    session_id = response.headers["X-Session-Id"]
+    deltas_url = f"/blackrock/challenge/v1/sessions/{session_id}/deltas"
+
+    # Non-positive or missing amounts are rejected by the schema.
+    for bad in ({"op": "update", "date": "2024-01-01 10:00:00", "amount": -5000000},
+                {"op": "insert", "date": "2024-01-03 10:00:00"}):
+        assert client.post(deltas_url, json={"deltas": [bad]}).status_code == 422
+
+    response = client.post(deltas_url, json={"deltas": [
+        {"op": "update", "date": "2024-01-01 10:00:00", "amount": 260},
+        {"op": "insert", "date": "2024-01-01 10:00:00", "amount": 100},
+        {"op": "update", "date": "2024-01-02 10:00:00", "amount": 100},
+        {"op": "insert", "date": "not a date", "amount": 100},
+        {"op": "insert", "date": "2024-01-03 10:00:00", "amount": 101},
+        {"op": "insert", "date": "2024-01-04 10:00:00", "amount": 199.5},
+    ]})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["totalTransactionAmount"] == 459.5
+
+    reasons = [(d["delta"]["date"], d["reason"]) for d in body["invalid_deltas"]]
+    assert reasons == [
+        ("2024-01-01 10:00:00", "A transaction at timestamp 2024-01-01 10:00:00 already exists."),
+        ("2024-01-02 10:00:00", "No transaction at timestamp 2024-01-02 10:00:00 to update."),
+        ("not a date", "Date 'not a date' does not match required format YYYY-MM-DD HH:MM:SS"),
+        ("2024-01-03 10:00:00", "Adding 99.0 would exceed your max investment limit of 100.0. Current total: 40.0."),
+    ]
+
+    # Only the accepted deltas reach the engine.
+    sent = mock_process.stdin.write.call_args_list[-1].args[0]
+    assert json.loads(sent) == {"deltas": [
+        {"op": "update", "date": "2024-01-01 10:00:00", "amount": 260.0},
+        {"op": "insert", "date": "2024-01-04 10:00:00", "amount": 199.5},
+    ]}
+
+    assert client.delete(f"/blackrock/challenge/v1/sessions/{session_id}").status_code == 200
+    mock_process.stdin.close.assert_called_once()
+    assert client.post(deltas_url, json={"deltas": []}).status_code == 404
+
+
+# -------------------------------------------------
+# Test 5b — Sub-Paise Amounts Never Reach The Engine
+# -------------------------------------------------
+@patch("subprocess.Popen")
+def test_sub_paise_amount_rejected(mock_popen):
+    payload = {
+        "age": 30,
+        "wage": 50000,
+        "inflation": 5.0,
+        "q": [], "p": [], "k": [],
+        "transactions": [{"date": "2024-01-01 10:00:00", "amount": 156.645}]
+    }
+
+    response = client.post("/blackrock/challenge/v1/returns:nps", json=payload)
+    assert response.status_code == 422
+    assert "whole number of paise" in response.text
+    mock_popen.assert_not_called()
+
+
+# -------------------------------------------------
+# Test 6 — Opt-In Profiling Produces A Chrome Trace
+# -------------------------------------------------
+@patch("subprocess.Popen")
+def test_profile_trace_exported(mock_popen):
+    phases = {"phases": [{"name": "parse", "startUs": 0, "durUs": 5}], "peakRssKb": 2048}
+    mock_process = MagicMock()
+    mock_process.communicate.return_value = (json.dumps({"ok": True}), json.dumps(phases))
+    mock_process.returncode = 0
+    mock_process.pid = 4242
+    mock_popen.return_value = mock_process
+
+    payload = {
+        "age": 30, "wage": 50000, "inflation": 5.0,
+        "q": [], "p": [], "k": [],
+        "transactions": [{"date": "2024-01-01 10:00:00", "amount": 250}]
+    }
+
+    response = client.post(
+        "/blackrock/challenge/v1/returns:nps",
+        json=payload,
+        headers={"X-Profile": "1"}
+    )
+    assert response.status_code == 200
+
+    args, kwargs = mock_process.communicate.call_args
+    assert json.loads(kwargs["input"])["profile"] is True
+
+    trace = client.get(f"/blackrock/challenge/v1/traces/{response.headers['X-Trace-Id']}").json()
+    names = {e["name"] for e in trace["traceEvents"] if e["ph"] == "X"}
+    assert {"build", "validate", "filter", "payload", "engine.spawn", "engine.run", "parse"} <= names
+    assert {"request.body", "request.validate", "response.serialize"} <= names
+    assert {"parse.ids", "validator.duplicates", "filter.transactions", "filter.period_checks"} <= names
+
+    counters = [e for e in trace["traceEvents"] if e["ph"] == "C"]
+    assert counters[0]["pid"] == 4242 and counters[0]["args"]["peakRssKb"] == 2048
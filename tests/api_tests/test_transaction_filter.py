@@ -224,4 +224,104 @@ def test_no_valid_transactions():
         json=payload
     )
 
-    assert response.json()["is_payload_safe_for_engine"] is False
\ No newline at end of file
+    assert response.json()["is_payload_safe_for_engine"] is False
+
+# ❌ 10. Period errors are returned
+def test_period_errors_returned():
+    payload = {
+        "wage": 500000,
+        "transactions": [
+            {**BASE_TXN, "date": "2026-01-05 10:00:00"},
+            {**BASE_TXN, "id": "txn_2", "date": "2026-01-10 10:00:00"}
+        ],
+        "q_periods": [{
+            "start": "2026-01-06 10:00:00",
+            "end": "2026-01-05 10:00:00",
+            "fixed": 10
+        }],
+        "p_periods": [],
+        "k_periods": [{
+            "start": "2026-01-05 10:00:00",
+            "end": "2026-13-01 00:00:00"
+        }]
+    }
+
+    response = client.post(
+        "/blackrock/challenge/v1/transactions:filter",
+        json=payload
+    )
+
+    errors = {e["period"]: e["reason"] for e in response.json()["period_errors"]}
+    assert errors["q_0"].startswith("Start date")
+    assert "invalid format" in errors["k_0"]
+
+
+# ✅ 11. Time-ordered input is flagged as sorted
+def test_sorted_input_flagged():
+    payload = {
+        "wage": 500000,
+        "transactions": [
+            {**BASE_TXN, "date": "2026-01-01 10:00:00"},
+            {**BASE_TXN, "id": "txn_2", "date": "2026-01-01 10:00:00"},
+            {**BASE_TXN, "id": "txn_3", "date": "2026-01-02 10:00:00"},
+        ],
+        "q_periods": [],
+        "p_periods": [],
+        "k_periods": []
+    }
+
+    response = client.post(
+        "/blackrock/challenge/v1/transactions:filter",
+        json=payload
+    )
+
+    data = response.json()
+    assert data["transactions_sorted"] is True
+    assert len(data["valid_transactions"]) == 2
+    assert data["invalid_transactions"][0]["transaction"]["id"] == "txn_2"
+
+
+# ❌ 12. Unordered input falls back to hashing and still catches duplicates
+def test_unsorted_input_duplicates():
+    payload = {
+        "wage": 500000,
+        "transactions": [
+            {**BASE_TXN, "date": "2026-01-02 10:00:00"},
+            {**BASE_TXN, "id": "txn_2", "date": "2026-01-01 10:00:00"},
+            {**BASE_TXN, "id": "txn_3", "date": "2026-01-02 10:00:00"},
+        ],
+        "q_periods": [],
+        "p_periods": [],
+        "k_periods": []
+    }
+
+    response = client.post(
+        "/blackrock/challenge/v1/transactions:filter",
+        json=payload
+    )
+
+    data = response.json()
+    assert data["transactions_sorted"] is False
+    assert [row["transaction"]["id"] for row in data["invalid_transactions"]] == ["txn_3"]
+
+
+# ✅ 13. A profiled call to the endpoint traces FastAPI's body handling and each filter stage
+def test_profiled_filter_stages():
+    payload = {
+        "wage": 500000,
+        "transactions": [{**BASE_TXN, "date": "2026-01-01 10:00:00"}],
+        "q_periods": [],
+        "p_periods": [],
+        "k_periods": []
+    }
+
+    response = client.post(
+        "/blackrock/challenge/v1/transactions:filter?profile=1",
+        json=payload
+    )
+    assert response.status_code == 200
+
+    trace = client.get(f"/blackrock/challenge/v1/traces/{response.headers['X-Trace-Id']}").json()
+    spans = [e["name"] for e in trace["traceEvents"] if e["ph"] == "X"]
+    assert spans.index("request.body") < spans.index("request.validate") < spans.index("filter.transactions")
+    assert {"filter.periods", "filter.period_checks", "response.serialize"} <= set(spans)
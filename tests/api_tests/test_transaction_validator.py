@@ -123,4 +123,61 @@ def test_validator_invalid_wage():
         json=payload
     )
 
-    assert response.status_code == 422
\ No newline at end of file
+    assert response.status_code == 422
+
+def test_validator_limit_uses_tax_table():
+    from api.main import TAX_TABLE
+
+    payload = {"wage": 5000000, "transactions": []}
+
+    response = client.post(
+        "/blackrock/challenge/v1/transactions:validator",
+        json=payload
+    )
+
+    assert response.status_code == 200
+    assert response.json()["summary"]["limit"] == TAX_TABLE["deduction"]["cap"]
+
+
+def test_validator_duplicate_of_rejected_row():
+    payload = {
+        "wage": 1000,   # 10% = 100 limit
+        "transactions": [
+            {"id": "txn_1", "date": "2026-02-20", "amount": 100,
+             "ceiling": 500, "remanent": 400, "status": "valid"},
+            {"id": "txn_1", "date": "2026-02-21", "amount": 90,
+             "ceiling": 100, "remanent": 10, "status": "valid"}
+        ]
+    }
+
+    response = client.post(
+        "/blackrock/challenge/v1/transactions:validator",
+        json=payload
+    )
+
+    data = response.json()
+    statuses = [row["transaction"]["status"] for row in data["invalid_transactions"]]
+    assert statuses == ["invalid_exceeds_limit", "duplicate"]
+    assert len(data["valid_transactions"]) == 0
+
+
+def test_validator_saturated_tail():
+    payload = {
+        "wage": 1000,   # 10% = 100 limit
+        "transactions": [
+            {"id": f"txn_{i}", "date": "2026-02-20", "amount": 50,
+             "ceiling": 100, "remanent": 50, "status": "valid"}
+            for i in range(5)
+        ]
+    }
+
+    response = client.post(
+        "/blackrock/challenge/v1/transactions:validator",
+        json=payload
+    )
+
+    data = response.json()
+    assert len(data["valid_transactions"]) == 2
+    assert data["summary"]["total_invested"] == 100
+    assert [row["transaction"]["id"] for row in data["invalid_transactions"]] == ["txn_2", "txn_3", "txn_4"]
+    assert len({row["reason"] for row in data["invalid_transactions"]}) == 1